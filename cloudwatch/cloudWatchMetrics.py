@@ -44,24 +44,51 @@ job already exists data will be sent to that job otherwise a new job
 with the ID is created. If no job ID is specified one will be automatically
 generated by the API
 
-Only EC2 metrics are monitored and only those belonging to an instance.
-Aggregated metrics by instance type and AMI metrics are ignored.
+By default EC2 metrics are monitored and only those belonging to an
+instance, aggregated metrics by instance type and AMI are ignored. Set
+--service once for each service to monitor, EC2, EBS, ELB or RDS, or to
+NAMESPACE:DIMENSION for any other namespace. Only the metrics with that
+one dimension are read and the dimension's value, the instance, volume,
+load balancer or database, is the record's 'instance' field. All the
+services are queried together in each cycle and uploaded to one job.
+
+The job created by the script has a detector for the mean of each
+metric listed for the services by the instance.
+
+The metrics are queried concurrently by --query-workers threads, queries
+CloudWatch throttles are retried after a randomised exponential backoff.
+For testing the configuration file may also set an endpoint, the
+CloudWatch API is then called at that host:port over plain HTTP
+
+    endpoint=localhost:8000
+
+The list of metrics is cached between queries and refreshed in the
+background every --catalog-ttl seconds, new and terminated instances
+are picked up within that time.
 
 Usage
     python cloudWatchMetrics.py awskey.conf
 
     python cloudWatchMetrics.py --job-id=cloudwatch --start-date=2014-10-01 awskey.conf
+
+    python cloudWatchMetrics.py --service=EC2 --service=ELB --service=RDS awskey.conf
 '''
 
 import argparse
+import collections
 import ConfigParser
 from datetime import datetime, timedelta, tzinfo
+import itertools
 import json
+from multiprocessing.pool import ThreadPool
+import random
 import StringIO
+import threading
 import time
 
 import boto.ec2
 import boto.ec2.cloudwatch
+from boto.ec2.regioninfo import RegionInfo
 from boto.exception import BotoServerError
 
 from prelert.engineApiClient import EngineApiClient
@@ -72,6 +99,9 @@ API_HOST = 'localhost'
 API_PORT = 8080
 API_BASE_URL = 'engine/v2'
 
+''' gzip compression level for the data uploaded to the Engine API'''
+COMPRESSION_LEVEL=6
+
 ''' Interval between query new data from CloudWatch (seconds)'''
 UPDATE_INTERVAL=300
 
@@ -88,50 +118,37 @@ of one minute (a day has 1440 minutes).
 '''
 MAX_DATAPOINTS_PER_QUERY = 1440
 
+''' The number of CloudWatch metric queries run at once '''
+QUERY_WORKERS=8
+
+''' Throttled or failed queries are retried this many times '''
+QUERY_RETRIES=5
+
+''' The longest wait before retrying a query (seconds) '''
+MAX_BACKOFF=20
+
+''' CloudWatch error codes returned when the request rate is too high '''
+THROTTLING_ERRORS = ('Throttling', 'RequestLimitExceeded')
+
+''' The list of metrics is refreshed when it is older than this (seconds) '''
+CATALOG_TTL=600
+
+''' In historical mode up to this many query windows are read at once '''
+WINDOW_WORKERS=4
+
 '''
-    Prelert Engine job configuration.
-    Multiple detectors configured one for each metric by the instance id.
+The namespace and the dimension identifying the resource
+of the metrics monitored for each service
 '''
-JOB_CONFIG = '{ %s\
-                "analysisConfig" : {\
-                    "bucketSpan":' + str(UPDATE_INTERVAL) + ',\
-                    "detectors" :[\
-                        {"function":"mean", "fieldName":"DiskReadOps", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"DiskReadBytes", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"DiskWriteOps", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"DiskWriteBytes", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"NetworkIn", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"NetworkOut", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"CPUUtilization", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"StatusCheckFailed", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"StatusCheckFailed_Instance", "byFieldName":"instance"},\
-                        {"function":"mean", "fieldName":"StatusCheckFailed_System", "byFieldName":"instance"}\
-                    ]\
-                },\
-                "dataDescription" : {"format":"JSON","timeField":"timestamp","timeFormat":"yyyy-MM-dd\'T\'HH:mm:ssX"\
-                }\
-            }'
-
-
-
-class MetricRecord:
-    '''
-    Simple holder class for the CloudWatch metrics.
-    toJsonStr returns the metric in a format for the job
-    configuration above.
-    '''
-    def __init__(self, timestamp, instance, metric_name, metric_value):
-        self.timestamp = timestamp
-        self.instance = instance
-        self.metric_name = metric_name
-        self.metric_value = metric_value
+SERVICES = {
+    'EC2' : ('AWS/EC2', 'InstanceId'),
+    'EBS' : ('AWS/EBS', 'VolumeId'),
+    'ELB' : ('AWS/ELB', 'LoadBalancerName'),
+    'RDS' : ('AWS/RDS', 'DBInstanceIdentifier')
+}
 
-    def toJsonStr(self):
-        result = '{"timestamp":"' + self.timestamp.isoformat() + \
-            '", "instance":"' + self.instance + '", "metric_name":"' + \
-            self.metric_name + '", "Average":' + str(self.metric_value) + '}'
-
-        return result
+''' The service monitored if none is set '''
+DEFAULT_SERVICE='EC2'
 
 
 class UTC(tzinfo):
@@ -149,6 +166,98 @@ def replaceTimezoneWithUtc(date):
     return date.replace(tzinfo=UTC())
 
 
+class MetricCatalog:
+    '''
+    Cache of the metrics CloudWatch lists for the namespaces. Listing
+    every metric of a large fleet takes many requests so the list is
+    only re-read once it is older than ttl seconds. The refresh runs
+    in a background thread, until it completes the previous list is
+    returned so the queries are not held up.
+    '''
+    def __init__(self, cloudwatch_conn, dimensions=None, ttl=CATALOG_TTL,
+            clock=time.time):
+        '''
+        dimensions is a list of (namespace, dimension) tuples, the
+        metrics of each namespace with only that dimension are listed.
+        The default is the EC2 instance metrics.
+        '''
+        self.cloudwatch_conn = cloudwatch_conn
+        self.dimensions = dimensions or [SERVICES[DEFAULT_SERVICE]]
+        self.ttl = ttl
+        self.clock = clock
+
+        self._metrics = None
+        self._listed_at = None
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+
+    def metrics(self):
+        '''
+        Return the list of metrics. The first call lists the metrics
+        and raises BotoServerError if that fails, if a later refresh
+        fails the error is printed and the old list kept.
+        '''
+        with self._lock:
+            if self._metrics is None:
+                self._metrics = self.listMetrics()
+                self._listed_at = self.clock()
+
+            stale = self.clock() - self._listed_at >= self.ttl
+            if stale and self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(target=self._refresh)
+                self._refresh_thread.daemon = True
+                self._refresh_thread.start()
+
+        return self._metrics
+
+    def listMetrics(self):
+        '''
+        List the metrics in each namespace having only the namespace's
+        dimension, following the continuation token over every page
+        of results
+        '''
+        metrics = []
+        for (namespace, dimension) in self.dimensions:
+            next_token = None
+            while True:
+                result = self.cloudwatch_conn.list_metrics(next_token=next_token,
+                    namespace=namespace)
+                metrics.extend(m for m in result if m.dimensions.keys() == [dimension])
+
+                next_token = result.next_token
+                if not next_token:
+                    break
+
+        return metrics
+
+    def _refresh(self):
+        try:
+            metrics = self.listMetrics()
+            with self._lock:
+                self._metrics = metrics
+                self._listed_at = self.clock()
+        except BotoServerError as error:
+            print "Error listing CloudWatch metrics"
+            print error
+        finally:
+            with self._lock:
+                self._refresh_thread = None
+
+
+def parseService(value):
+    '''
+    Return the (namespace, dimension) tuple for the --service
+    argument, either a service name or NAMESPACE:DIMENSION
+    '''
+    if value in SERVICES:
+        return SERVICES[value]
+
+    if ':' not in value:
+        raise argparse.ArgumentTypeError("unknown service '" + value +
+            "', use one of " + ", ".join(sorted(SERVICES)) + " or NAMESPACE:DIMENSION")
+
+    return tuple(value.rsplit(':', 1))
+
 def parseArguments():
     parser = argparse.ArgumentParser()
 
@@ -170,6 +279,25 @@ def parseArguments():
         If --start-date is not set this argument has no meaning. \
         Dates must be in YYYY-MM-DD format",
         default=None, dest="end_date")
+    parser.add_argument("--compression-level", help="gzip compress the data \
+        uploaded to the Engine API at this level (1-9), 0 disables compression. \
+        Defaults to " + str(COMPRESSION_LEVEL), type=int,
+        default=COMPRESSION_LEVEL, dest="compression_level")
+    parser.add_argument("--query-workers", help="The number of CloudWatch \
+        metric queries run at once, defaults to " + str(QUERY_WORKERS),
+        type=int, default=QUERY_WORKERS, dest="query_workers")
+    parser.add_argument("--catalog-ttl", help="Refresh the cached list of \
+        CloudWatch metrics after this many seconds, defaults to " + str(CATALOG_TTL),
+        type=int, default=CATALOG_TTL, dest="catalog_ttl")
+    parser.add_argument("--window-workers", help="In historical mode query \
+        this many time windows at once, each with up to --query-workers \
+        concurrent queries. Defaults to " + str(WINDOW_WORKERS),
+        type=int, default=WINDOW_WORKERS, dest="window_workers")
+    parser.add_argument("--service", help="Monitor this service's metrics, one \
+        of " + ", ".join(sorted(SERVICES)) + " or NAMESPACE:DIMENSION for the \
+        metrics with that dimension. Repeat to monitor several services, \
+        defaults to " + DEFAULT_SERVICE, type=parseService, action="append",
+        default=None, dest="services")
 
     return parser.parse_args()
 
@@ -184,108 +312,180 @@ def calculateIntervalBetweenQueries(reporting_interval):
     return timedelta(seconds = MAX_DATAPOINTS_PER_QUERY * reporting_interval)
 
 
-def queryMetricRecords(metrics, start, end, reporting_interval):
+def queryWindows(start_date, end_date, delta):
     '''
-        Return the metrics sorted by date.
-        The Average statistic is always taken
+    Generator yielding the (start, end) datetimes of consecutive
+    windows of length delta from start_date to end_date, the last
+    window may be shorter
     '''
-    metric_records = []
-    for m in metrics:
-        if 'InstanceId' not in m.dimensions:
-            continue
-        instance = m.dimensions['InstanceId'][0]
+    end = start_date
+    while end < end_date:
+        start = end
+        end = min(start + delta, end_date)
+        yield (start, end)
 
-        datapoints = m.query(start, end, 'Average', period=reporting_interval)
-        for dp in datapoints:
-            # annoyingly Boto does not return datetimes with a timezone
-            utc_time = replaceTimezoneWithUtc(dp['Timestamp'])
-            mr = MetricRecord(utc_time, instance, m.name, dp['Average'])
-            metric_records.append(mr)
 
+def queryDatapoints(metric, start, end, reporting_interval, retries=QUERY_RETRIES):
+    '''
+    Query the Average statistic of the metric. If CloudWatch throttles
+    the request or fails with a server error the query is retried after
+    a random wait of up to an exponentially growing backoff so the
+    concurrent queries do not retry in step.
+    '''
+    attempt = 0
+    while True:
+        try:
+            return metric.query(start, end, 'Average', period=reporting_interval)
+        except BotoServerError as error:
+            throttled = error.error_code in THROTTLING_ERRORS
+            if not (throttled or error.status >= 500) or attempt >= retries:
+                raise
+
+            attempt += 1
+            time.sleep(random.uniform(0, min(MAX_BACKOFF, 0.5 * 2 ** attempt)))
+
+
+def queryMetricRecords(metrics, start, end, reporting_interval, workers=QUERY_WORKERS):
+    '''
+        Return a list of (instance, metric_name, datapoints) tuples,
+        one for each metric where instance is the value of the metric's
+        only dimension. The Average statistic is always taken, the
+        metrics are queried concurrently by up to workers threads.
+    '''
+    metrics = [m for m in metrics if len(m.dimensions) == 1]
+    if not metrics:
+        return []
+
+    def queryMetric(m):
+        return queryDatapoints(m, start, end, reporting_interval)
+
+    pool = ThreadPool(min(workers, len(metrics)))
+    try:
+        # wait with a timeout as a plain wait cannot be interrupted by Ctrl C
+        results = pool.map_async(queryMetric, metrics).get(0xFFFF)
+    finally:
+        pool.close()
+        pool.join()
 
-    metric_records.sort(key=lambda r : r.timestamp)
-    return metric_records
+    return [(m.dimensions.values()[0][0], m.name, datapoints)
+        for (m, datapoints) in zip(metrics, results)]
 
 
-def transposeMetrics(metrics):
+def transposeMetrics(metric_records):
     '''
-    Convert a list of metrics of the form
-    {time_1, instance, metric_A, Average},
-    {time_1, instance, metric_B, Average},
-    {time_1, instance, metric_C, Average}
-    {time_2, instance, metric_A, Average}
+    Convert a list of the datapoints of each instance metric
+    (instance_1, metric_A, [{time_1, Average}, {time_2, Average}, ...])
+    (instance_1, metric_B, [{time_1, Average}, {time_2, Average}, ...])
+    (instance_2, metric_A, [{time_1, Average}, {time_2, Average}, ...])
     ...
 
-    To a single record so that there is 1 record for each time period.
-    {time_1, instance, metric_A, metric_B, metric_C}
-    {time_2, instance, metric_A, metric_B, metric_C}
+    To a single record for each instance in each time period.
+    {time_1, instance_1, metric_A, metric_B}
+    {time_1, instance_2, metric_A}
+    {time_2, instance_1, metric_A, metric_B}
+    ...
 
-    The input list must be ordered by timestamp
+    Generator yielding the records in time order. The datapoints are
+    grouped by timestamp then instance so only the distinct timestamps
+    are sorted, not every datapoint, and the datapoints need not be
+    in order.
     '''
 
-    tranposed_metrics = []
-    current_record = None;
-    current_time = datetime.fromtimestamp(0, UTC());
+    records_by_time = dict()
+    for (instance, metric_name, datapoints) in metric_records:
+        for dp in datapoints:
+            records = records_by_time.get(dp['Timestamp'])
+            if records == None:
+                records = records_by_time[dp['Timestamp']] = collections.OrderedDict()
+
+            record = records.get(instance)
+            if record == None:
+                record = records[instance] = {'instance' : instance}
 
-    for metric in metrics:
+            record[metric_name] = dp['Average']
 
-        if current_time < metric.timestamp:
-            current_time = metric.timestamp
+    for timestamp in sorted(records_by_time):
+        # annoyingly Boto does not return datetimes with a timezone
+        utc_time = replaceTimezoneWithUtc(timestamp).isoformat()
+        for record in records_by_time[timestamp].itervalues():
+            record['timestamp'] = utc_time
+            yield record
 
-            if current_record != None:
-                tranposed_metrics.append(current_record)
-            current_record = dict()
-            current_record['timestamp'] = metric.timestamp.isoformat()
-            current_record['instance'] = metric.instance
 
-        current_record[metric.metric_name] = metric.metric_value
+def uploadRecords(engine_client, job_id, records):
+    '''
+    Stream the records to the job as newline delimited JSON in one
+    chunked upload, gzip compressed if the client has a compression
+    level. The records are encoded as they are written so the upload
+    is never built as one string.
+
+    Returns a (http_status_code, response) tuple
+    '''
+    encoder = json.JSONEncoder(separators=(',', ':'))
 
-    return tranposed_metrics
+    with engine_client.openStream(job_id) as uploader:
+        uploader.writelines(encoder.encode(record) + '\n' for record in records)
 
+    return uploader.result
 
-def runHistorical(job_id, start_date, end_date, cloudwatch_conn, engine_client):
+
+def runHistorical(job_id, start_date, end_date, catalog, engine_client,
+        workers=QUERY_WORKERS, window_workers=WINDOW_WORKERS):
     '''
     Query and analyze the CloudWatch metrics from start_date to end_date.
     If end_date == None then run until the time now.
+
+    The range is split into windows of as many datapoints as a query
+    may return. Up to window_workers windows are queried at once ahead
+    of the upload, the windows are uploaded in time order as each
+    completes.
     '''
+    if end_date == None:
+        end_date = replaceTimezoneWithUtc(datetime.utcnow())
 
-    end = start_date
     delta = calculateIntervalBetweenQueries(REPORTING_INTERVAL)
+    windows = queryWindows(start_date, end_date, delta)
 
-    while True:
-
-        start = end
-        end = start + delta
-        if (end > end_date):
-            end = end_date
+    def queryWindow(window):
+        (start, end) = window
+        metrics = catalog.metrics()
+        metric_records = queryMetricRecords(metrics, start, end, reporting_interval = REPORTING_INTERVAL,
+            workers=workers)
 
-        if start == end:
-            break
+        return list(transposeMetrics(metric_records))
 
-        print "Querying metrics starting at time " + str(start.isoformat())
+    pool = ThreadPool(window_workers)
+    # the windows being queried in time order
+    pending = collections.deque()
+    try:
+        while True:
+            for window in itertools.islice(windows, window_workers - len(pending)):
+                pending.append((window, pool.apply_async(queryWindow, (window,))))
 
-        try:
-            metrics = cloudwatch_conn.list_metrics(namespace='AWS/EC2')
-            metric_records = queryMetricRecords(metrics, start, end, reporting_interval = REPORTING_INTERVAL)
+            if not pending:
+                break
 
-            tranposed_metrics = transposeMetrics(metric_records)
+            ((start, end), result) = pending.popleft()
+            print "Querying metrics starting at time " + str(start.isoformat())
 
-            data = ''
-            for met in tranposed_metrics:
-                json_str = json.dumps(met)
-                data += json_str + '\n'
+            try:
+                # wait with a timeout as a plain wait cannot be interrupted by Ctrl C
+                tranposed_metrics = result.get(0xFFFF)
 
-            (http_status, response) = engine_client.upload(job_id, data)
-            if http_status != 202:
-                print "Error uploading metric data to the Engine"
-                print http_status, json.dumps(response)
+                (http_status, response) = uploadRecords(engine_client, job_id, tranposed_metrics)
+                if http_status != 202:
+                    print "Error uploading metric data to the Engine"
+                    print http_status, json.dumps(response)
 
-        except BotoServerError as error:
-            print "Error querying CloudWatch"
-            print error
+            except BotoServerError as error:
+                print "Error querying CloudWatch"
+                print error
+    finally:
+        pool.close()
+        pool.join()
 
 
-def runRealtime(job_id, cloudwatch_conn, engine_client):
+def runRealtime(job_id, catalog, engine_client, workers=QUERY_WORKERS):
     '''
     Query the previous 5 minutes of metric data every 5 minutes
     then upload to the Prelert Engine.
@@ -307,17 +507,12 @@ def runRealtime(job_id, cloudwatch_conn, engine_client):
             print "Querying metrics from " + str(start.isoformat())  + " to " + end.isoformat()
 
             try:
-                metrics = cloudwatch_conn.list_metrics(namespace='AWS/EC2')
-                metric_records = queryMetricRecords(metrics, start, end, reporting_interval = REPORTING_INTERVAL)
+                metrics = catalog.metrics()
+                metric_records = queryMetricRecords(metrics, start, end, reporting_interval = REPORTING_INTERVAL,
+                    workers=workers)
                 tranposed_metrics = transposeMetrics(metric_records)
 
-                data = ''
-                for met in tranposed_metrics:
-                    json_str = json.dumps(met)
-                    data += json_str + '\n'
-
-
-                (http_status, response) = engine_client.upload(job_id, data)
+                (http_status, response) = uploadRecords(engine_client, job_id, tranposed_metrics)
                 if http_status != 202:
                     print "Error uploading metric data to the Engine"
                     print http_status, json.dumps(response)
@@ -339,45 +534,65 @@ def runRealtime(job_id, cloudwatch_conn, engine_client):
         return
 
 
-def createJob(job_id, client):
+def jobConfig(metrics, job_id=None):
+    '''
+    Return the job configuration as a JSON string. The job has
+    a detector for the mean of each distinct metric name in the
+    list of metrics by the instance. If job_id is set the job is
+    created with that ID.
+    '''
+    detectors = [{"function" : "mean", "fieldName" : metric_name, "byFieldName" : "instance"}
+        for metric_name in sorted(set(m.name for m in metrics))]
+
+    config = {"analysisConfig" : {"bucketSpan" : UPDATE_INTERVAL, "detectors" : detectors},
+        "dataDescription" : {"format" : "JSON", "timeField" : "timestamp",
+            "timeFormat" : "yyyy-MM-dd'T'HH:mm:ssX"}}
+    if job_id != None:
+        config['id'] = job_id
+
+    return json.dumps(config)
+
+
+def createJob(job_id, client, catalog):
     '''
     Create the job. If job_id == None then create the job with
     a default Id else use job_id. If the job already exists
-    return job_id and continue.
+    return job_id and continue. A new job is configured for the
+    metrics in the catalog.
 
     Returns the created job_id or None if the job could not
     be created.
     '''
 
-    # if no job id create a new job
-    if job_id == None:
-        # no job id in the config
-        config = JOB_CONFIG % ''
-        (http_status, response) = client.createJob(config)
-        if http_status != 201:
-            print "Error creating job"
-            print response
-            return None
-
-        job_id = response['id']
-        print "Created job with automatic ID " + job_id
-    else:
+    if job_id != None:
         (http_status, response) = client.getJob(job_id)
-        if http_status == 404:
-            # no job id in the config
-            config = JOB_CONFIG % ('"id" : "' + job_id + '",')
-            (http_status, response) = client.createJob(config)
-            if http_status != 201:
-                print "Error creating job"
-                print response
-                return None
-
-            job_id = response['id']
-            print "Created job with ID " + job_id
-        else:
+        if http_status != 404:
             print "Using job with ID " + job_id
+            return job_id
+
+    # a job needs at least one detector
+    metrics = catalog.metrics()
+    if not metrics:
+        services = ', '.join(namespace + " by " + dimension
+            for (namespace, dimension) in catalog.dimensions)
+        print "Error no CloudWatch metrics found for " + services + \
+            " in region " + catalog.cloudwatch_conn.region.name
+        print "Check the region and services, only metrics with the " + \
+            "service's single dimension are analysed"
+        return None
+
+    (http_status, response) = client.createJob(jobConfig(metrics, job_id))
+    if http_status != 201:
+        print "Error creating job"
+        print response
+        return None
+
+    if job_id == None:
+        print "Created job with automatic ID " + response['id']
+    else:
+        print "Created job with ID " + response['id']
 
-    return job_id
+    return response['id']
 
 
 def main():
@@ -407,7 +622,15 @@ def main():
 
 
     # AWS CloudWatch connection
-    cloudwatch_conn = boto.ec2.cloudwatch.connect_to_region(region,
+    if config.has_option('root', 'endpoint'):
+        (host, port) = config.get('root', 'endpoint').split(':')
+        cloudwatch_conn = boto.ec2.cloudwatch.CloudWatchConnection(
+                 aws_access_key_id=access_id,
+                 aws_secret_access_key=secret_key,
+                 region=RegionInfo(name=region, endpoint=host),
+                 port=int(port), is_secure=False)
+    else:
+        cloudwatch_conn = boto.ec2.cloudwatch.connect_to_region(region,
                  aws_access_key_id=access_id,
                  aws_secret_access_key=secret_key)
 
@@ -415,11 +638,21 @@ def main():
         print "Error unknown region " + region
         return
 
+    # The metrics of all the services are listed once
+    # then refreshed every catalog_ttl seconds
+    catalog = MetricCatalog(cloudwatch_conn, args.services, args.catalog_ttl)
+
     # The Prelert REST API client
-    engine_client = EngineApiClient(args.api_host, API_BASE_URL, args.api_port)
+    engine_client = EngineApiClient(args.api_host, API_BASE_URL, args.api_port,
+        compression_level=args.compression_level)
 
     # If no job ID is supplied create a new job
-    job_id = createJob(args.job_id, engine_client)
+    try:
+        job_id = createJob(args.job_id, engine_client, catalog)
+    except BotoServerError as error:
+        print "Error listing CloudWatch metrics"
+        print error
+        return
     if job_id == None:
         return
 
@@ -430,7 +663,7 @@ def main():
         start_date = replaceTimezoneWithUtc(start_date)
 
     if start_date == None:
-        runRealtime(job_id, cloudwatch_conn, engine_client)
+        runRealtime(job_id, catalog, engine_client, args.query_workers)
     else:
         # historical mode, check for an end date
         end_date = replaceTimezoneWithUtc(datetime.utcnow())
@@ -438,7 +671,8 @@ def main():
             end_date = datetime.strptime(args.end_date, "%Y-%m-%d")
             end_date = replaceTimezoneWithUtc(end_date)
 
-        runHistorical(job_id, start_date, end_date, cloudwatch_conn, engine_client)
+        runHistorical(job_id, start_date, end_date, catalog, engine_client,
+            args.query_workers, args.window_workers)
 
 
     print "Closing job..."
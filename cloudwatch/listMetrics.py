@@ -44,7 +44,7 @@ import boto.ec2.cloudwatch
 def parseArguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("config", help="The AWS connection parameters.")
-    parser.add_argument("--service", choices=["EC2", "EBS"],
+    parser.add_argument("--service", choices=["EC2", "EBS", "ELB", "RDS"],
             default="EC2", dest="service",
             help="The AWS service for which metrics will be listed. By default it is EC2.")
 
@@ -43,6 +43,30 @@ except ImportError:
     # For Python 2.x
     from urllib2 import urlopen
 
+# The number of results requested in each page
+PAGE_SIZE = 500
+
+
+def documents(url, limit):
+    """
+    Generator that requests the results a page at a time and yields
+    each document, so only one page is held in memory at once.  url
+    must contain '%d' placeholders for the skip and take arguments.  At
+    most limit documents are returned.
+    """
+    skip = 0
+    while skip < limit:
+        take = min(PAGE_SIZE, limit - skip)
+        response = urlopen(url % (skip, take)).read()
+        page = json.loads(response.decode('utf-8'))
+        for document in page['documents']:
+            yield document
+
+        if not page['nextPage']:
+            break
+        skip += take
+
+
 if len(sys.argv) < 3:
     sys.stderr.write('Usage: %s <job> <server_hostname> [ <server_port> [ <result_limit> ] ]\n' % sys.argv[0])
     sys.exit(1)
@@ -54,16 +78,13 @@ if len(sys.argv) >= 4:
     port = sys.argv[3]
 limit = 10000
 if len(sys.argv) >= 5:
-    limit = sys.argv[4]
+    limit = int(sys.argv[4])
 
-url = 'http://%s:%s/engine/v2/results/%s/influencers?take=%s' % (server, port, job, limit)
-response = urlopen(url).read()
-json = json.loads(response.decode('utf-8'))
+url = 'http://%s:%s/engine/v2/results/%s/influencers?skip=%%d&take=%%d' % (server, port, job)
 writtenHeader = False
 csvWriter = csv.writer(sys.stdout)
-for document in json['documents']:
+for document in documents(url, limit):
     if not writtenHeader:
         csvWriter.writerow([ key for key in sorted(document) ])
         writtenHeader = True
     csvWriter.writerow([ str(document[key]) for key in sorted(document) ])
-
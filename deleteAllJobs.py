@@ -19,7 +19,8 @@
 '''
 Delete all the jobs in the Engine API. 
 Request a list of jobs configured in the API then
-delete them one at a time using the job id.
+delete them in parallel using the job id.
+Use --prefix and --status to only delete some of the jobs.
 
 Be careful with this one you can't change your mind afterwards.
 '''
@@ -36,6 +37,7 @@ from prelert.engineApiClient import EngineApiClient
 HOST = 'localhost'
 PORT = 8080
 BASE_URL = 'engine/v2'
+WORKERS = 8
 
 def parseArguments():
     parser = argparse.ArgumentParser()
@@ -43,10 +45,44 @@ def parseArguments():
         + HOST, default=HOST)
     parser.add_argument("--port", help="The Prelert Engine API port defaults to "
         + str(PORT), default=PORT)
+    parser.add_argument("--workers", help="The number of jobs deleted concurrently, "
+        "defaults to " + str(WORKERS), type=int, default=WORKERS)
+    parser.add_argument("--rate", help="The maximum number of delete requests "
+        "per second, unlimited if not set", type=float, default=None)
+    parser.add_argument("--prefix", help="Only delete jobs whose id starts "
+        "with this prefix", default=None)
+    parser.add_argument("--status", help="Only delete jobs with this status "
+        "e.g. CLOSED. May be repeated", action="append", default=None)
     
     return parser.parse_args()   
 
 
+def listJobIds(engine_client, prefix, statuses):
+    '''
+    Page through all the jobs and return the ids of those
+    matching the prefix and statuses filters.
+    Returns None if a request fails.
+    '''
+    job_ids = []
+    skip = 0
+    while True:
+        (http_status_code, response) = engine_client.getJobs(skip=skip)
+        if http_status_code != 200:
+            print (http_status_code, json.dumps(response))
+            return None
+
+        for job in response['documents']:
+            if prefix and not job['id'].startswith(prefix):
+                continue
+            if statuses and job.get('status') not in statuses:
+                continue
+            job_ids.append(job['id'])
+
+        if not response.get('nextPage'):
+            return job_ids
+        skip += len(response['documents'])
+
+
 def main():
     args = parseArguments()
     host = args.host
@@ -54,30 +90,30 @@ def main():
 
 
     # Create the REST API client
-    engine_client = EngineApiClient(host, BASE_URL, port)
+    engine_client = EngineApiClient(host, BASE_URL, port, pool_size=args.workers)
 
-    while True:
-        (http_status_code, response) = engine_client.getJobs()
+    job_ids = listJobIds(engine_client, args.prefix, args.status)
+    if job_ids is None:
+        return
+
+    print "Deleting %d jobs" % (len(job_ids)),
+
+    def progress(job_id, http_status_code, response):
         if http_status_code != 200:
-            print (http_status_code, json.dumps(response))
-            break
-        
-        jobs = response['documents']        
-        if (len(jobs) == 0):
-            print "Deleted all jobs"
-            break
-
-
-        print "Deleting %d jobs" % (len(jobs)),
-
-        for job in jobs:
-            (http_status_code, response) = engine_client.delete(job['id'])
-            if http_status_code != 200:
-                print (http_status_code, json.dumps(response))
-            else:
-                sys.stdout.write('.')
-                sys.stdout.flush()
-        print
+            print (job_id, http_status_code, json.dumps(response))
+        else:
+            sys.stdout.write('.')
+            sys.stdout.flush()
+
+    results = engine_client.deleteJobs(job_ids, workers=args.workers,
+        rate_limit=args.rate, progress_callback=progress)
+    print
+
+    failed = [job_id for (job_id, result) in results.iteritems() if result[0] != 200]
+    if failed:
+        print "Failed to delete %d jobs" % (len(failed))
+    else:
+        print "Deleted %d jobs" % (len(job_ids))
 
      
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+A durable record of a backfill's progress so an interrupted run can be
+resumed into the same job. The checkpoint is a small JSON file holding
+
+    {"job_id" : "...", "start_date" : "YYYY-MM-DD", "end_date" : "YYYY-MM-DD",
+     "index" : "logstash-YYYY.MM.DD",
+     "timestamp" : 1401580800000, "sort" : [1401580800000], "ids" : ["..."],
+     "docs" : 12345}
+
+where index, timestamp and sort describe the last document uploaded
+and ids are the ids of the uploaded documents sharing that timestamp.
+The file is replaced atomically so a crash never leaves it half written.
+"""
+
+import json
+import os
+
+
+class Checkpoint:
+
+
+    def __init__(self, path):
+        """
+        path is the checkpoint file
+        """
+        self.path = path
+        self.state = dict()
+
+
+    def load(self):
+        """
+        Read the checkpoint file, returns False if it does not exist
+        """
+        try:
+            with open(self.path, 'r') as checkpoint_file:
+                self.state = json.load(checkpoint_file)
+        except IOError:
+            return False
+
+        return True
+
+    def save(self):
+        """
+        Write the state to a temporary file then rename it over
+        the checkpoint file
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        """
+        Delete the checkpoint file once the backfill is complete
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def update(self, hits):
+        """
+        Record that the page of hits has been uploaded. The hits must
+        come from a query sorted on '@timestamp' so each has a 'sort'
+        value.
+        """
+        last = hits[-1]
+        timestamp = last['sort'][0]
+        ids = [hit['_id'] for hit in hits if hit['sort'][0] == timestamp]
+
+        # the documents with the last timestamp may span pages
+        if self.state.get('index') == last['_index'] and \
+                self.state.get('timestamp') == timestamp:
+            ids = self.state['ids'] + ids
+
+        self.state['index'] = last['_index']
+        self.state['timestamp'] = timestamp
+        self.state['sort'] = last['sort']
+        self.state['ids'] = ids
+        self.state['docs'] = self.state.get('docs', 0) + len(hits)
+        self.save()
+
+    def resumeQuery(self, query):
+        """
+        Return a copy of the query dict restricted to documents at or
+        after the checkpoint timestamp
+        """
+        timestamp_range = {"range" : {"@timestamp" : {"gte" : self.state['timestamp']}}}
+
+        query = dict(query)
+        query['query'] = {"filtered" : {
+            "query" : query.get('query', {"match_all" : {}}),
+            "filter" : timestamp_range}}
+
+        return query
+
+    def skipUploaded(self, pages):
+        """
+        Return a generator yielding the pages of hits from a resumeQuery
+        search without the documents already uploaded at the checkpoint
+        timestamp
+        """
+        # copy the state now as it changes once the uploads start
+        return self._skipUploaded(pages, set(self.state['ids']),
+            self.state['timestamp'])
+
+    def _skipUploaded(self, pages, uploaded, timestamp):
+        for hits in pages:
+            if uploaded:
+                hits = [hit for hit in hits
+                    if not (hit['sort'][0] == timestamp and hit['_id'] in uploaded)]
+                if hits and hits[-1]['sort'][0] != timestamp:
+                    uploaded = None
+                if not hits:
+                    continue
+
+            yield hits
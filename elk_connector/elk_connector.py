@@ -43,7 +43,11 @@ import sys
 
 import elasticsearch.exceptions
 from elasticsearch import Elasticsearch
-from prelert.engineApiClient import EngineApiClient
+from prelert.engineApiClient import EngineApiClient, EngineApiError
+
+from checkpoint import Checkpoint
+from es_reader import ScrollError, readIndexes
+from upload_pipeline import UploadPipeline, QUEUE_SIZE
 
 
 # Elasticsearch connection settings
@@ -55,10 +59,11 @@ API_HOST = 'localhost'
 API_PORT = 8080
 API_BASE_URL = 'engine/v2'
 
+# gzip compression level for the data uploaded to the Engine API
+COMPRESSION_LEVEL = 6
 
-# The maximum number of documents to request from
-# Elasticsearch in each query
-MAX_DOC_TAKE = 5000
+# The number of logstash indexes read in parallel
+INDEX_WORKERS = 4
 
 
 def setupLogging():
@@ -86,23 +91,28 @@ def parseArguments():
     parser.add_argument("--end-date", help="Pull data up to this date, if not \
         set all indexes from --start-date are searched. Dates must be in \
         YYYY-MM-DD format", default=None, dest="end_date")
+    parser.add_argument("--compression-level", help="gzip compress the data \
+        uploaded to the Engine API at this level (1-9), 0 disables compression. \
+        Defaults to " + str(COMPRESSION_LEVEL), type=int,
+        default=COMPRESSION_LEVEL, dest="compression_level")
+    parser.add_argument("--queue-size", help="The maximum number of pages of \
+        documents read ahead of the upload to the Engine API, defaults to "
+        + str(QUEUE_SIZE), type=int, default=QUEUE_SIZE, dest="queue_size")
+    parser.add_argument("--index-workers", help="The number of daily logstash \
+        indexes read from Elasticsearch in parallel, the documents are still \
+        uploaded in time order. Defaults to " + str(INDEX_WORKERS), type=int,
+        default=INDEX_WORKERS, dest="index_workers")
+    parser.add_argument("--checkpoint", help="Record the progress of the \
+        upload in this file. Defaults to the config file name with the \
+        extension '.checkpoint' in the current directory", default=None,
+        dest="checkpoint")
+    parser.add_argument("--resume", help="Resume an interrupted run from \
+        the checkpoint file, the data is sent to the same job",
+        action="store_true", default=False, dest="resume")
 
 
     return parser.parse_args()   
 
-def elasticSearchDocsToDicts(hits):
-    """
-    Convert the Elasticsearch hits into an list of dict objects
-    In this case we use the '_source' object as the desired fields
-    were set in the query.
-    """
-    
-    objs = []
-    for hit in hits:
-        objs.append(hit['_source']) 
-
-    return objs
-
 def nextLogStashIndex(start_date, end_date):
     """
     Generator method for listing all the Logstash index names
@@ -157,6 +167,15 @@ def main():
         return
 
 
+    checkpoint_path = args.checkpoint
+    if checkpoint_path == None:
+        checkpoint_path = os.path.splitext(os.path.basename(args.file))[0] + ".checkpoint"
+    checkpoint = Checkpoint(checkpoint_path)
+
+    if args.resume and not checkpoint.load():
+        print "Cannot resume, no checkpoint file " + checkpoint_path
+        return
+
     # default start date is None meaning 'all time'
     start_date = None
     if args.start_date != None:
@@ -166,80 +185,111 @@ def main():
     end_date = datetime.today()
     if args.end_date != None:
         end_date = datetime.strptime(args.end_date, "%Y-%m-%d")
+
+    resume_index = None
+    if args.resume:
+        # restart from the index of the last uploaded document
+        resume_index = checkpoint.state.get('index')
+        if resume_index:
+            start_date = datetime.strptime(resume_index.lstrip("logstash-"), "%Y.%m.%d")
+        else:
+            start_date = datetime.strptime(checkpoint.state['start_date'], "%Y-%m-%d")
+        end_date = datetime.strptime(checkpoint.state['end_date'], "%Y-%m-%d")
    
 
     # The ElasticSearch client
     es_client = Elasticsearch(args.es_host + ":" + str(args.es_port))
 
     data_type = config['type']
-    search_body = json.dumps(config['search'])
+    search_query = config['search']
+    search_body = json.dumps(search_query)
 
     # If no start date find the first logstash index containing our docs
-    if start_date == None:        
+    if start_date == None and not args.resume:        
         start_date = findDateOfFirstIndex(es_client, data_type, search_body)
         if start_date == None:
             print "No documents found with the query " + search_body
             return
 
     # The REST API client
-    engine_client = EngineApiClient(args.api_host, API_BASE_URL, args.api_port)
-    (http_status, response) = engine_client.createJob(json.dumps(config['job_config']))
-    if http_status != 201:
-        print "Error creatting job"
-        print http_status, json.dumps(response)
-        return
-
-
-    job_id = response['id']  
-    print "Created job with id " + str(job_id)
-
-    doc_count = 0
-    for index_name in nextLogStashIndex(start_date, end_date):
-
-        print "Reading from index " + index_name
-
-        skip = 0
-        try:
-            # Query the documents from ElasticSearch and write to the Engine
-            hits = es_client.search(index=index_name, doc_type=data_type, 
-                body=search_body, from_=skip, size=MAX_DOC_TAKE)
-        except elasticsearch.exceptions.NotFoundError:
-            # Index not found try the next one
-            continue
-
-        # upload to the API
-        content = json.dumps(elasticSearchDocsToDicts(hits['hits']['hits']))        
-        (http_status, response) = engine_client.upload(job_id, content)
-        if http_status != 202:
-            print "Error uploading log content to the Engine"
+    engine_client = EngineApiClient(args.api_host, API_BASE_URL, args.api_port,
+        compression_level=args.compression_level)
+
+    index_queries = dict()
+    if args.resume:
+        job_id = checkpoint.state['job_id']
+        print "Resuming job {0} from {1} after {2} records".format(job_id,
+            start_date.strftime("%Y-%m-%d"), checkpoint.state.get('docs', 0))
+
+        # only read the first index from the last uploaded document
+        if resume_index:
+            index_queries[resume_index] = checkpoint.resumeQuery(search_query)
+    else:
+        (http_status, response) = engine_client.createJob(json.dumps(config['job_config']))
+        if http_status != 201:
+            print "Error creatting job"
             print http_status, json.dumps(response)
-            continue
-
-        doc_count += len(hits['hits']['hits']) 
-
-        # get any other docs
-        hitcount = int(hits['hits']['total'])
-        while hitcount > (skip + MAX_DOC_TAKE):    
-            skip += MAX_DOC_TAKE
-            hits = es_client.search(index=index_name, doc_type=data_type, 
-                body=search_body, from_=skip, size=MAX_DOC_TAKE)
+            return
 
-            content = json.dumps(elasticSearchDocsToDicts(hits['hits']['hits']))        
-            (http_status, response) = engine_client.upload(job_id, content)
-            if http_status != 202:
-                print json.dumps(response)
+        job_id = response['id']  
+        print "Created job with id " + str(job_id)
+
+        checkpoint.state = {'job_id' : job_id,
+            'start_date' : start_date.strftime("%Y-%m-%d"),
+            'end_date' : end_date.strftime("%Y-%m-%d")}
+        checkpoint.save()
+
+    # The next page is read from Elasticsearch while
+    # the previous one is uploaded to the Engine. The
+    # checkpoint is updated after each upload. Elasticsearch
+    # has already filtered the '_source' fields.
+    pipeline = UploadPipeline(engine_client, job_id, None,
+        args.queue_size, checkpoint.update)
+    indexes = readIndexes(es_client, nextLogStashIndex(start_date, end_date),
+        data_type, search_query, args.index_workers, index_queries=index_queries)
+    try:
+        for (index_name, pages) in indexes:
+
+            print "Reading from index " + index_name
+
+            try:
+                # The index is scrolled in time order by a background
+                # thread, queue each page for upload
+                if index_name == resume_index:
+                    # drop the documents uploaded at the checkpoint timestamp
+                    pages = checkpoint.skipUploaded(pages)
+                pipeline.feed(pages)
+            except elasticsearch.exceptions.NotFoundError:
+                # Index not found try the next one
                 continue
-
-            doc_count += len(hits['hits']['hits']) 
-
-
-        print "Uploaded {0} records".format(str(doc_count))
+            except ScrollError:
+                # The rest of the index cannot be read, stop rather than
+                # skip it. The checkpoint holds the last page uploaded.
+                pipeline.close()
+                print pipeline.summary()
+                print "Error reading index " + index_name + ", once fixed run again with --resume"
+                raise
+
+            print pipeline.summary()
+
+        pipeline.close()
+    except EngineApiError:
+        # The pipeline stopped at the rejected page, the
+        # checkpoint holds the last page the Engine accepted
+        print pipeline.summary()
+        print "Upload rejected by the Engine, once fixed run again with --resume"
+        raise
+
+    print pipeline.summary()
+    doc_count = pipeline.upload_stats.docs
         
     (http_status, response) = engine_client.close(job_id)
     if http_status != 202:
         print "Error closing job"
         print http_status, json.dumps(response)
         return
+
+    checkpoint.remove()
     print "{0} records successfully written to job {1}".format(str(doc_count), job_id)
 
 
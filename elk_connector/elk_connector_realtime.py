@@ -28,6 +28,13 @@ is the path to a config file containing the Engine Job configuration
 and the elasticsearch query. If a job id is provided then the logs 
 are sent to that job else a new job is created. 
 
+Several config files can be given to feed a job for each from one
+Elasticsearch query per window. Each config's search becomes a named
+filter in the combined query and every hit is uploaded to the jobs
+whose filters it matched, so Elasticsearch is queried once however
+many jobs there are. Pass '--job-id' once per config file, in the same
+order, to use existing jobs.
+
 The script attempts to add a date range filter for the real-time date 
 arguments to the elasticsearch query defined in the config file, if it 
 cannot because 'filter' and 'post_filter' are already defined then
@@ -42,6 +49,9 @@ See:
 Example:  
     python elk_connector_realtime.py --es-host=elasticsearchserver
         --api-host=prelertserver --job-id=jobid configs/syslog.json 
+
+    python elk_connector_realtime.py --es-host=elasticsearchserver
+        --api-host=prelertserver configs/syslog.json configs/apache-access.json
 """
 
 import argparse
@@ -50,12 +60,16 @@ import json
 import logging
 import os
 import sys
-import time
 
 import elasticsearch.exceptions
 from elasticsearch import Elasticsearch
 from prelert.engineApiClient import EngineApiClient
 
+from es_reader import scrollPages, sourceFields
+from fan_out import FanOut, combinedQuery
+from scheduler import RecentHits, WindowScheduler
+from upload_pipeline import UploadPipeline
+
 
 # Elasticsearch connection settings
 ES_HOST = 'localhost'
@@ -66,14 +80,17 @@ API_HOST = 'localhost'
 API_PORT = 8080
 API_BASE_URL = 'engine/v2'
 
-# The maximum number of documents to request from
-# Elasticsearch in each query
-MAX_DOC_TAKE = 5000
+# gzip compression level for the data uploaded to the Engine API
+COMPRESSION_LEVEL = 6
 
 # The update interval in seconds
 # elasticsearch is queried with this periodicity
 UPDATE_INTERVAL = 60
 
+# The number of seconds each query reaches back before its
+# window to pick up documents indexed late
+OVERLAP = 0
+
 
 class UTC(tzinfo):
     """
@@ -99,8 +116,9 @@ def setupLogging():
 def parseArguments():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("file", 
-                help="Read the configuration from the specified file")
+    parser.add_argument("files", nargs="+", metavar="file",
+                help="Read the configuration from the specified file, \
+                with several files each job is fed from one combined query")
     parser.add_argument("--es-host", help="The host machine Elasticsearch is \
         running on, defaults to '" + ES_HOST + "'", default=ES_HOST, dest="es_host")
     parser.add_argument("--es-port", help="The Elasticsearch HTTP port, defaults to " 
@@ -110,27 +128,24 @@ def parseArguments():
     parser.add_argument("--api-port", help="The Prelert Engine API port, defaults to " 
         + str(API_PORT), default=API_PORT, dest="api_port")
     parser.add_argument("--job-id", help="Send data to this job. If not set a \
-        new job will be created.", default=None, dest="job_id")    
+        new job will be created. Repeat once per config file when there are \
+        several.", action="append", default=None, dest="job_ids")    
     parser.add_argument("--update-interval", help="The period between each \
         each cycle of querying and uploading data", type=int,
         default=UPDATE_INTERVAL, dest="update_interval")
+    parser.add_argument("--overlap", help="Each query also reads this many \
+        seconds before its window to catch documents that reach Elasticsearch \
+        late, documents already uploaded are skipped. Late documents may be \
+        out of time order so the job must allow for latency. Defaults to "
+        + str(OVERLAP), type=int, default=OVERLAP, dest="overlap")
+    parser.add_argument("--compression-level", help="gzip compress the data \
+        uploaded to the Engine API at this level (1-9), 0 disables compression. \
+        Defaults to " + str(COMPRESSION_LEVEL), type=int,
+        default=COMPRESSION_LEVEL, dest="compression_level")
 
 
     return parser.parse_args()   
 
-def elasticSearchDocsToDicts(hits):
-    """
-    Convert the Elasticsearch hits into an list of dict objects
-    In this case we use the '_source' object as the desired fields
-    were set in the query.
-    """
-
-    objs = []
-    for hit in hits:
-        objs.append(hit['_source']) 
-
-    return objs
-
 def logstashIndex(date):
     """
     Return the logstash index name for the given date
@@ -140,6 +155,18 @@ def logstashIndex(date):
 
     return "logstash-" + date.strftime("%Y.%m.%d")
 
+def logstashIndexes(start_time, end_time):
+    """
+    Generator yielding the names of the logstash indexes holding
+    documents between the datetimes start_time and end_time
+    """
+    date = start_time.date()
+    # end_time is not included in the range
+    last_date = (end_time - timedelta(microseconds=1)).date()
+    while date <= last_date:
+        yield logstashIndex(date)
+        date += timedelta(days=1)
+
 
 def insertDateRangeFilter(query):
     """
@@ -181,12 +208,13 @@ def replaceDateArgs(query, query_start_time, query_end_time):
     Replace the date arguments in the range filter of the query.
     """
 
-    if not 'filter' in query:
-        query['filter']['range']['@timestamp']['gte'] = query_start_time.isoformat()
-        query['filter']['range']['@timestamp']['lt'] = query_end_time.isoformat()
+    if '@timestamp' in query.get('post_filter', {}).get('range', {}):
+        date_range = query['post_filter']['range']['@timestamp']
     else:
-        query['post_filter']['range']['@timestamp']['gte'] = query_start_time.isoformat()
-        query['post_filter']['range']['@timestamp']['lt'] = query_end_time.isoformat()
+        date_range = query['filter']['range']['@timestamp']
+
+    date_range['gte'] = query_start_time.isoformat()
+    date_range['lt'] = query_end_time.isoformat()
 
     return query
 
@@ -196,12 +224,19 @@ def main():
     setupLogging()
     args = parseArguments()
 
-    # read the config file
-    try:
-        with open(args.file, "r") as config_file:
-            config = json.load(config_file)
-    except IOError:
-        print "Error opening file " + args.file
+    # read the config files
+    configs = []
+    for file_name in args.files:
+        try:
+            with open(file_name, "r") as config_file:
+                configs.append(json.load(config_file))
+        except IOError:
+            print "Error opening file " + file_name
+            return
+
+    job_ids = args.job_ids
+    if job_ids != None and len(job_ids) != len(configs):
+        print "Error: give one --job-id for each config file"
         return
   
 
@@ -209,84 +244,76 @@ def main():
     es_client = Elasticsearch(args.es_host + ":" + str(args.es_port))
 
     # The REST API client
-    engine_client = EngineApiClient(args.api_host, API_BASE_URL, args.api_port)
-
-    job_id = args.job_id
-    if job_id == None:
-        (http_status, response) = engine_client.createJob(json.dumps(config['job_config']))
-        job_id = response['id']  
-        print "Created job with id " + str(job_id)
-
-    print "Using job id " + job_id
-
-    data_type = config['type']
-    raw_query = insertDateRangeFilter(config['search'])
-    
+    engine_client = EngineApiClient(args.api_host, API_BASE_URL, args.api_port,
+        compression_level=args.compression_level)
+
+    if job_ids == None:
+        job_ids = []
+        for config in configs:
+            (http_status, response) = engine_client.createJob(json.dumps(config['job_config']))
+            job_ids.append(response['id'])
+            print "Created job with id " + str(response['id'])
+
+    for job_id in job_ids:
+        print "Using job id " + job_id
+
+    # Pages are uploaded by a background thread per job while
+    # the rest of the window is read
+    if len(configs) == 1:
+        data_type = configs[0]['type']
+        raw_query = insertDateRangeFilter(configs[0]['search'])
+        # Elasticsearch has already filtered the '_source' fields
+        sink = UploadPipeline(engine_client, job_ids[0])
+
+        def windowQuery(query_start_time, query_end_time):
+            return replaceDateArgs(raw_query, query_start_time, query_end_time)
+    else:
+        # the hits are routed by the names of the filters they
+        # matched, each job's filter is named by its id
+        searches = [(job_id, config['type'], config['search'])
+            for (job_id, config) in zip(job_ids, configs)]
+        data_type = ','.join(sorted(set(config['type'] for config in configs)))
+        sink = FanOut(dict((job_id, UploadPipeline(engine_client, job_id,
+            sourceFields(config['search']))) for (job_id, config) in zip(job_ids, configs)))
+
+        def windowQuery(query_start_time, query_end_time):
+            return combinedQuery(searches, query_start_time, query_end_time)
+
+    # Consecutive windows of update_interval seconds, a
+    # slow cycle is caught up rather than leaving a gap
+    scheduler = WindowScheduler(args.update_interval, args.overlap)
+    recent_hits = RecentHits()
 
     timezone = UTC()
-    doc_count = 0    
     try:
-        query_end_time = datetime.now(timezone) - timedelta(seconds=args.update_interval)
-        while True:
-            query_start_time = query_end_time
-            query_end_time = datetime.now(timezone)
-            query_str = json.dumps(replaceDateArgs(raw_query, query_start_time, 
-                query_end_time)) 
-            index_name = logstashIndex(query_start_time)        
-
-            skip = 0
-            try:
-                # Query the documents from ElasticSearch and write to the Engine
-                hits = es_client.search(index=index_name, doc_type=data_type, 
-                    body=query_str, from_=skip, size=MAX_DOC_TAKE)
-            except elasticsearch.exceptions.NotFoundError:
-                print "Error: missing logstash index '" + index_name + "'"
-                
-
-            # upload to the API
-            content = json.dumps(elasticSearchDocsToDicts(hits['hits']['hits'])) 
-            
-            (http_status, response) = engine_client.upload(job_id, content)
-            if http_status != 202:
-                print "Error uploading log content to the Engine"
-                print http_status, json.dumps(response)
-                
-
-            doc_count += len(hits['hits']['hits'])                 
-
-            # get any other docs
-            hitcount = int(hits['hits']['total'])
-            while hitcount > (skip + MAX_DOC_TAKE):    
-                skip += MAX_DOC_TAKE
-                hits = es_client.search(index=index_name, doc_type=data_type, 
-                    body=query_str, from_=skip, size=MAX_DOC_TAKE)
-
-                content = json.dumps(elasticSearchDocsToDicts(hits['hits']['hits']))
-
-                (http_status, response) = engine_client.upload(job_id, content)
-                if http_status != 202:
-                    print "Error uploading log content to the Engine"
-                    print json.dumps(response)
-                    
-
-                doc_count += len(hits['hits']['hits']) 
-
-            print "Uploaded {0} records".format(str(doc_count))
-
-            duration = datetime.now(timezone) - query_end_time
-            sleep_time = max(args.update_interval - duration.seconds, 0)
-            print "sleeping for " + str(sleep_time) + " seconds"
-
-            if sleep_time > 0.0:                
-                time.sleep(sleep_time)
-
+        for (query_start, window_start, window_end) in scheduler.windows():
+            query_start_time = datetime.fromtimestamp(query_start, timezone)
+            query_end_time = datetime.fromtimestamp(window_end, timezone)
+            query = windowQuery(query_start_time, query_end_time)
+
+            # the window may span midnight and so two indexes
+            for index_name in logstashIndexes(query_start_time, query_end_time):
+                try:
+                    # Scroll through the documents in time order and
+                    # queue each page not already uploaded
+                    sink.feed(recent_hits.filter(
+                        scrollPages(es_client, index_name, data_type, query)))
+                except elasticsearch.exceptions.NotFoundError:
+                    print "Error: missing logstash index '" + index_name + "'"
+
+            # the next query starts overlap seconds before this window ended
+            recent_hits.expire(window_end - args.overlap)
+
+            print "{0}, lag {1:.1f} seconds".format(sink.summary(), scheduler.lag())
   
     except KeyboardInterrupt:
         print "Interrupt caught closing job..."
 
-    
+    sink.close()
+    print sink.summary()
 
-    engine_client.close(job_id)
+    for job_id in job_ids:
+        engine_client.close(job_id)
 
 
 if __name__ == "__main__":
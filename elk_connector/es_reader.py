@@ -0,0 +1,299 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Read every document matching a query from a logstash index using the
+Elasticsearch scroll API. Unlike from/size paging the cost of each
+page does not grow with its offset and there is no limit on the
+number of documents that can be read, so an index is read in time
+linear in the number of documents.
+
+    for hit in scrollHits(es_client, 'logstash-2014.06.01', 'apache-access', query):
+        print hit['_source']
+
+readIndexes reads several indexes at once with a thread per index,
+the pages are returned one index at a time in the order given.
+
+A missing index raises elasticsearch.exceptions.NotFoundError from
+the first search, a scroll that fails after that raises ScrollError
+as the rest of the index cannot be read.
+"""
+
+import collections
+import copy
+import logging
+import Queue
+import threading
+
+import elasticsearch.exceptions
+
+# The maximum number of documents to request from
+# Elasticsearch in each query
+MAX_DOC_TAKE = 5000
+
+# How long Elasticsearch keeps the scroll context alive between pages
+SCROLL_TIMEOUT = '2m'
+
+# Documents are read in time order, the Engine expects records
+# to be presented in that order
+TIMESTAMP_SORT = [{"@timestamp" : {"order" : "asc"}}]
+
+# The number of pages each index reader may get ahead of the consumer
+PREFETCH_PAGES = 4
+
+# An index reader whose pages are waiting for the consumer to finish
+# the indexes before it gives up its scroll after this many seconds,
+# before the scroll context expires, and reads the index again once
+# the consumer reaches it. Must be well within SCROLL_TIMEOUT.
+QUEUED_READER_WAIT = 60
+
+
+class ScrollError(Exception):
+    """
+    Raised when scrolling an index fails after the first page, for
+    example because the scroll context expired. Unlike a missing index
+    the documents not yet read would be lost so the error must not be
+    ignored.
+    """
+    pass
+
+
+def sortedOnTimestamp(query):
+    """
+    Return a copy of the query dict sorted on '@timestamp' if it
+    does not already define a sort order.
+    """
+    query = copy.deepcopy(query)
+    if 'sort' not in query:
+        query['sort'] = TIMESTAMP_SORT
+
+    return query
+
+def sourceFields(query):
+    """
+    Return the list of '_source' fields the query selects or None
+    if it returns the whole document or selects fields by pattern
+    """
+    source = query.get('_source')
+    if isinstance(source, dict):
+        source = source.get('includes', source.get('include'))
+    if isinstance(source, basestring):
+        source = [source]
+
+    if not isinstance(source, list) or any('*' in field for field in source):
+        return None
+
+    return source
+
+def scrollPages(es_client, index, doc_type, query, page_size=MAX_DOC_TAKE,
+        scroll=SCROLL_TIMEOUT):
+    """
+    Generator yielding the hits matching query (a dict) in index
+    one page at a time, each page is a list of up to page_size hits.
+    The hits are in the query's sort order, '@timestamp' ascending if
+    the query does not set one.
+
+    elasticsearch.exceptions.NotFoundError is raised if the
+    index does not exist. ScrollError is raised if a later page
+    cannot be read or the scroll ends before all the matching
+    documents have been returned, as when the scroll context has
+    expired.
+    """
+    response = es_client.search(index=index, doc_type=doc_type,
+        body=sortedOnTimestamp(query), scroll=scroll, size=page_size)
+    scroll_id = response.get('_scroll_id')
+    total = response['hits']['total']
+    docs_read = 0
+
+    try:
+        while response['hits']['hits']:
+            yield response['hits']['hits']
+            docs_read += len(response['hits']['hits'])
+
+            try:
+                response = es_client.scroll(scroll_id=scroll_id, scroll=scroll)
+            except elasticsearch.exceptions.TransportError as error:
+                raise ScrollError("Scrolling index {0} failed after {1} of {2} "
+                    "documents: {3}".format(index, docs_read, total, error))
+            scroll_id = response.get('_scroll_id', scroll_id)
+
+        # an expired scroll context may return no hits rather than an error
+        if docs_read < total:
+            raise ScrollError("Scroll of index {0} ended after {1} of {2} "
+                "documents".format(index, docs_read, total))
+    finally:
+        # free the scroll context rather than waiting for it to expire
+        if scroll_id:
+            try:
+                es_client.clear_scroll(scroll_id=scroll_id)
+            except elasticsearch.exceptions.TransportError as error:
+                logging.warn("Failed to clear scroll: " + str(error))
+
+def scrollHits(es_client, index, doc_type, query, page_size=MAX_DOC_TAKE,
+        scroll=SCROLL_TIMEOUT):
+    """
+    Generator yielding the hits matching query in index one at a
+    time in sort order, see scrollPages.
+    """
+    for page in scrollPages(es_client, index, doc_type, query, page_size, scroll):
+        for hit in page:
+            yield hit
+
+def readIndexes(es_client, indexes, doc_type, query, workers=4,
+        page_size=MAX_DOC_TAKE, prefetch=PREFETCH_PAGES, index_queries=None):
+    """
+    Generator yielding an (index, pages) tuple for each index name in
+    indexes, in the same order. pages is an iterator over the index's
+    pages of hits, see scrollPages, and must be consumed before the
+    next tuple is requested. Iterating pages raises
+    elasticsearch.exceptions.NotFoundError if the index does not exist.
+
+    Up to workers indexes are scrolled at once by background threads,
+    each reading up to prefetch pages ahead. A reader left waiting for
+    the consumer to reach its index for QUEUED_READER_WAIT seconds
+    drops its pages and scroll and reads the index again when it is
+    reached, so no scroll context expires while waiting. Logstash writes each
+    day's documents to that day's index so reading the daily indexes
+    in parallel and returning them in date order keeps the documents
+    in time order.
+
+    index_queries is an optional dict of index name to the query used
+    for that index instead of query.
+    """
+    indexes = iter(indexes)
+    index_queries = index_queries or dict()
+    readers = collections.deque()
+
+    def startReaders():
+        while len(readers) < workers:
+            try:
+                index = next(indexes)
+            except StopIteration:
+                return
+            readers.append(_IndexReader(es_client, index, doc_type,
+                index_queries.get(index, query), page_size, prefetch))
+
+    try:
+        startReaders()
+        while readers:
+            reader = readers[0]
+            reader.makeHead()
+            yield (reader.index, reader.pages())
+
+            reader.stop()
+            readers.popleft()
+            startReaders()
+    finally:
+        for reader in readers:
+            reader.stop()
+
+
+class _IndexReader:
+    """
+    Scrolls an index in a background thread into a bounded queue
+    """
+
+    def __init__(self, es_client, index, doc_type, query, page_size, prefetch):
+        self.index = index
+        self._queue = Queue.Queue(prefetch)
+        self._stopped = threading.Event()
+        # set once the consumer is reading this index
+        self._head = threading.Event()
+        self._lock = threading.Lock()
+        self._wait = QUEUED_READER_WAIT
+        self._thread = threading.Thread(target=self._read,
+            args=(es_client, doc_type, query, page_size))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def makeHead(self):
+        """
+        Called before the consumer starts reading the pages,
+        the reader then no longer gives up its scroll
+        """
+        with self._lock:
+            self._head.set()
+
+    def pages(self):
+        """
+        Generator yielding the pages in order, exceptions raised
+        reading the index are re-raised here
+        """
+        while True:
+            (page, error) = self._queue.get()
+            if error is not None:
+                raise error
+            if page is None:
+                return
+            yield page
+
+    def stop(self):
+        """
+        Stop reading, the scroll is cleared
+        """
+        self._stopped.set()
+
+    def _read(self, es_client, doc_type, query, page_size):
+        while not self._stopped.is_set():
+            pages = scrollPages(es_client, self.index, doc_type, query, page_size)
+            try:
+                for page in pages:
+                    if not self._put((page, None), True):
+                        break
+                else:
+                    self._put((None, None), False)
+                    return
+            except Exception as error:
+                self._put((None, error), False)
+                return
+            finally:
+                pages.close()
+
+            # the scroll was given up, read the index
+            # again once the consumer reaches it
+            while not self._stopped.is_set() and not self._head.wait(0.5):
+                pass
+
+    def _put(self, item, scrolling):
+        """
+        Queue the item, returns False if the reader was stopped first.
+        If scrolling is True and the queue stays full for the reader's
+        wait time before the consumer reaches the index the queued
+        pages are dropped and False returned.
+        """
+        waited = 0.0
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except Queue.Full:
+                waited += 0.5
+
+            if scrolling and waited >= self._wait:
+                with self._lock:
+                    if not self._head.is_set():
+                        self._discardPages()
+                        return False
+
+        return False
+
+    def _discardPages(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Queue.Empty:
+                return
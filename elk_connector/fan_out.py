@@ -0,0 +1,127 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Feed many Engine jobs from a single Elasticsearch query.
+
+Each job's config selects documents by type and by its search's
+'query', 'filter' and 'post_filter'. These are combined into one query where every
+job's selection is a named filter, Elasticsearch then lists the names
+of the filters each hit matched in its 'matched_queries' and the hit
+is routed to those jobs. Each job has its own UploadPipeline sending
+the job's projected '_source' fields.
+
+    query = combinedQuery(searches, start_time, end_time)
+    fan_out = FanOut(pipelines)
+    fan_out.feed(scrollPages(es_client, index, doc_types, query))
+    fan_out.close()
+"""
+
+from es_reader import TIMESTAMP_SORT, sourceFields
+
+
+def namedFilter(name, doc_type, search):
+    """
+    A filter named name matching the documents of doc_type
+    selected by the search's 'query', 'filter' and 'post_filter'
+    """
+    must = [{"type" : {"value" : doc_type}}]
+    if 'query' in search:
+        must.append({"query" : search['query']})
+    for key in ('filter', 'post_filter'):
+        if key in search:
+            must.append(search[key])
+
+    return {"bool" : {"must" : must, "_name" : name}}
+
+def combinedQuery(searches, start_time, end_time):
+    """
+    Build the query for the documents between the datetimes
+    start_time and end_time matching any of the searches.
+    searches is a list of (name, doc_type, search) tuples where search
+    is the 'search' object of a job config.
+
+    The query returns the union of the searches' '_source' fields
+    or the whole document if any search does not restrict them.
+    """
+    date_range = {"range" : {"@timestamp" : {"gte" : start_time.isoformat(),
+        "lt" : end_time.isoformat()}}}
+    filters = [namedFilter(name, doc_type, search) for (name, doc_type, search) in searches]
+
+    query = {"query" : {"filtered" : {"filter" : {"and" : [date_range, {"or" : filters}]}}},
+        "sort" : TIMESTAMP_SORT}
+
+    fields = set()
+    for (name, doc_type, search) in searches:
+        search_fields = sourceFields(search)
+        if search_fields is None:
+            return query
+        fields.update(search_fields)
+
+    query['_source'] = sorted(fields)
+    return query
+
+
+class FanOut:
+
+
+    def __init__(self, pipelines):
+        """
+        pipelines is a dict of filter name to the UploadPipeline
+        of the job the matching hits are sent to
+        """
+        self.pipelines = pipelines
+        self.docs_read = 0
+        # Hits that matched none of the named filters
+        self.unmatched = 0
+
+
+    def feed(self, pages):
+        """
+        Route each page of hits from the iterable pages to the
+        pipelines of the jobs each hit matched, preserving order
+        """
+        for hits in pages:
+            self.docs_read += len(hits)
+
+            routed = dict()
+            for hit in hits:
+                names = hit.get('matched_queries')
+                if not names:
+                    self.unmatched += 1
+                    continue
+                for name in names:
+                    routed.setdefault(name, []).append(hit)
+
+            for (name, job_hits) in routed.iteritems():
+                self.pipelines[name].put(job_hits)
+
+    def close(self):
+        """
+        Wait for all the pipelines to finish uploading
+        """
+        for pipeline in self.pipelines.itervalues():
+            pipeline.close()
+
+    def summary(self):
+        """
+        The statistics as a line of text for progress reports
+        """
+        uploaded = sum(pipeline.upload_stats.docs for pipeline in self.pipelines.itervalues())
+        queued = sum(pipeline.queueDepth() for pipeline in self.pipelines.itervalues())
+        return "Read {0} records, uploaded {1} records to {2} jobs, {3} pages queued".format(
+            self.docs_read, uploaded, len(self.pipelines), queued)
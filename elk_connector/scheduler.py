@@ -0,0 +1,137 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Query windows for reading logstash data in real time.
+
+The windows are fixed intervals counted from the time the scheduler
+starts so they never drift however long each query takes, there are
+no gaps between them and a slow cycle is caught up by the following
+windows rather than skipped. Each query can start overlap seconds
+before its window to pick up documents that reached Elasticsearch
+late, RecentHits drops the documents seen by the previous query.
+
+    scheduler = WindowScheduler(60, overlap=10)
+    recent = RecentHits()
+    for (query_start, window_start, window_end) in scheduler.windows():
+        pages = recent.filter(scrollPages(...))
+        ...
+        recent.expire(window_end - scheduler.overlap)
+"""
+
+import time
+
+# When behind schedule several intervals are read in one query,
+# up to this many at once
+MAX_CATCHUP_INTERVALS = 10
+
+
+class WindowScheduler:
+
+
+    def __init__(self, interval, overlap=0, max_catchup=MAX_CATCHUP_INTERVALS,
+            clock=time.time, sleep=time.sleep):
+        """
+        interval is the length of a window in seconds
+        overlap is the number of seconds each query reaches back
+          before the start of its window
+        max_catchup is the maximum number of intervals merged into
+          one window when catching up
+        """
+        self.interval = interval
+        self.overlap = overlap
+        self.max_catchup = max_catchup
+        self.clock = clock
+        self.sleep = sleep
+
+        # The end of the most recent window, epoch seconds
+        self.window_end = None
+
+
+    def windows(self):
+        """
+        Generator yielding a (query_start, window_start, window_end)
+        tuple of epoch seconds for each window once its end has passed.
+        The first window is the interval before the generator starts.
+        """
+        origin = self.clock() - self.interval
+        count = 0
+
+        while True:
+            window_start = origin + count * self.interval
+
+            # whole intervals elapsed since the start of the window,
+            # sleep until the window has ended
+            while True:
+                now = self.clock()
+                elapsed = int((now - window_start) // self.interval)
+                if elapsed >= 1:
+                    break
+                self.sleep(window_start + self.interval - now)
+
+            count += min(elapsed, self.max_catchup)
+            self.window_end = origin + count * self.interval
+
+            yield (window_start - self.overlap, window_start, self.window_end)
+
+    def lag(self):
+        """
+        Seconds between now and the end of the most recent window,
+        how far behind real time the uploaded data is
+        """
+        if self.window_end is None:
+            return 0.0
+        return self.clock() - self.window_end
+
+
+class RecentHits:
+    """
+    Remembers the ids of the hits seen in the overlap period so
+    documents read by two overlapping queries are only uploaded once.
+    The hits must come from a query sorted on '@timestamp'.
+    """
+
+    def __init__(self):
+        # _id to '@timestamp' sort value (epoch milliseconds)
+        self._seen = dict()
+
+
+    def filter(self, pages):
+        """
+        Generator yielding the pages of hits without those seen before
+        """
+        for hits in pages:
+            hits = [hit for hit in hits if hit['_id'] not in self._seen]
+            for hit in hits:
+                self._seen[hit['_id']] = hit['sort'][0]
+
+            if hits:
+                yield hits
+
+    def expire(self, before):
+        """
+        Forget the hits with a timestamp before the epoch seconds
+        before, no later query reaches back that far
+        """
+        # Elasticsearch truncates the query's start time to whole
+        # milliseconds, keep the hits it will return again
+        before_ms = int(before * 1000)
+        self._seen = dict((doc_id, timestamp) for (doc_id, timestamp)
+            in self._seen.iteritems() if timestamp >= before_ms)
+
+    def __len__(self):
+        return len(self._seen)
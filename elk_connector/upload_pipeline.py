@@ -0,0 +1,258 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Overlap reading from Elasticsearch with uploading to the Engine API.
+Pages of hits are put on a bounded queue by the reading thread and
+uploaded in the same order by a background thread, so the next page
+is read while the previous one is being uploaded. When the queue is
+full reading blocks until the upload catches up.
+
+Each page is uploaded as newline delimited JSON, one '_source' object
+per line, written record by record into a chunked upload stream so
+the page is never held in memory a second time as one large string.
+
+    pipeline = UploadPipeline(engine_client, job_id, fields=['@timestamp', 'response'])
+    pipeline.feed(scrollPages(es_client, index, doc_type, query))
+    pipeline.close()
+    print pipeline.summary()
+"""
+
+import json
+import logging
+import Queue
+import threading
+import time
+
+from prelert.engineApiClient import EngineApiError
+
+# The maximum number of pages waiting to be uploaded
+QUEUE_SIZE = 4
+
+
+class StageStats:
+    """
+    Document count and busy time of one stage of the pipeline
+    """
+
+    def __init__(self):
+        self.docs = 0
+        self.seconds = 0.0
+
+    def add(self, docs, seconds):
+        self.docs += docs
+        self.seconds += seconds
+
+    def rate(self):
+        """
+        Documents per second while the stage was busy
+        """
+        if self.seconds == 0.0:
+            return 0.0
+        return self.docs / self.seconds
+
+
+# Compact separators, the Engine does not need the whitespace
+ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+def projectFields(source, fields):
+    """
+    Return a copy of the '_source' object with only the fields.
+    As in Elasticsearch '_source' filtering a field may be a dotted
+    path, 'geoip.country_name' selects the country_name field of the
+    geoip object and the result keeps it nested in a geoip object.
+    """
+    projected = dict()
+    for field in fields:
+        if field in source:
+            projected[field] = source[field]
+            continue
+
+        keys = field.split('.')
+        value = source
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = projected
+            for key in keys[:-1]:
+                target = target.setdefault(key, dict())
+                if not isinstance(target, dict):
+                    break
+            else:
+                target[keys[-1]] = value
+
+    return projected
+
+def ndjsonRecords(hits, fields=None):
+    """
+    Generator yielding each hit's '_source' object as a line of JSON.
+    If fields is set the objects are projected to those fields, see
+    projectFields.
+    """
+    # plain field names are the common case and cheaper to project
+    nested = fields is not None and any('.' in field for field in fields)
+
+    for hit in hits:
+        source = hit['_source']
+        if nested:
+            source = projectFields(source, fields)
+        elif fields is not None:
+            source = {field : source[field] for field in fields if field in source}
+
+        yield ENCODER.encode(source) + '\n'
+
+
+class UploadPipeline:
+
+
+    def __init__(self, engine_client, job_id, fields=None,
+            queue_size=QUEUE_SIZE, on_upload=None):
+        """
+        engine_client is the EngineApiClient used for the uploads
+        job_id the job the data is sent to
+        fields if set the '_source' fields uploaded to the Engine,
+          by default all the fields are sent
+        queue_size is the maximum number of pages buffered between
+          the reader and the uploader
+        on_upload if set is called with each page of hits once it has
+          been uploaded, it is called from the upload thread. A page the
+          Engine rejects then stops the pipeline with an EngineApiError
+          so on_upload is never called for the pages after it, otherwise
+          the rejected page is counted in failed_uploads and skipped.
+        """
+        self.engine_client = engine_client
+        self.job_id = job_id
+        self.fields = fields
+        self.on_upload = on_upload
+
+        self.read_stats = StageStats()
+        self.upload_stats = StageStats()
+        # Number of uploads the Engine rejected
+        self.failed_uploads = 0
+
+        self._queue = Queue.Queue(queue_size)
+        # An exception that stopped the upload thread
+        self._error = None
+        self._thread = threading.Thread(target=self._uploadPages)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def feed(self, pages):
+        """
+        Read each page of hits from the iterable pages and queue it
+        for upload. Blocks while the queue is full. Any exception
+        raised reading the pages is passed on to the caller.
+        """
+        pages = iter(pages)
+        while True:
+            start = time.time()
+            try:
+                hits = next(pages)
+            except StopIteration:
+                return
+            self.read_stats.add(len(hits), time.time() - start)
+
+            self.put(hits)
+
+    def put(self, hits):
+        """
+        Queue a page of hits for upload, blocks while the queue is full
+        """
+        self._checkError()
+        # poll so a failed upload thread cannot block the reader forever
+        while True:
+            try:
+                self._queue.put(hits, timeout=1.0)
+                return
+            except Queue.Full:
+                self._checkError()
+
+    def close(self):
+        """
+        Wait for the queued pages to be uploaded and stop the
+        upload thread. If an upload raised an exception it is
+        re-raised here.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._checkError()
+
+    def queueDepth(self):
+        """
+        The number of pages waiting to be uploaded. A queue that is
+        always full means the Engine is the bottleneck, an empty queue
+        means Elasticsearch is.
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Return a dictionary of the pipeline statistics,
+        rates are in documents per second
+        """
+        return {'queue_depth' : self.queueDepth(),
+            'docs_read' : self.read_stats.docs,
+            'read_rate' : self.read_stats.rate(),
+            'docs_uploaded' : self.upload_stats.docs,
+            'upload_rate' : self.upload_stats.rate(),
+            'failed_uploads' : self.failed_uploads}
+
+    def summary(self):
+        """
+        The statistics as a line of text for progress reports
+        """
+        return ("Read {0} records ({1:.0f}/s), uploaded {2} records ({3:.0f}/s), "
+            "{4} pages queued").format(self.read_stats.docs, self.read_stats.rate(),
+            self.upload_stats.docs, self.upload_stats.rate(), self.queueDepth())
+
+    def _checkError(self):
+        if self._error is not None:
+            raise self._error
+
+    def _uploadPages(self):
+        while True:
+            hits = self._queue.get()
+            if hits is None:
+                return
+
+            start = time.time()
+            try:
+                with self.engine_client.openStream(self.job_id) as uploader:
+                    uploader.writelines(ndjsonRecords(hits, self.fields))
+                (http_status, response) = uploader.result
+
+                if http_status != 202:
+                    print "Error uploading log content to the Engine"
+                    print http_status, json.dumps(response)
+                    self.failed_uploads += 1
+                    if self.on_upload:
+                        # a later page must not move the checkpoint
+                        # past the one that was not uploaded
+                        raise EngineApiError(http_status, response)
+                    continue
+
+                self.upload_stats.add(len(hits), time.time() - start)
+                if self.on_upload:
+                    self.on_upload(hits)
+            except Exception as error:
+                logging.error("Upload failed: " + str(error))
+                self._error = error
+                return
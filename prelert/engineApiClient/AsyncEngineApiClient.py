@@ -0,0 +1,142 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+A non-blocking client to the Prelert Engine REST API.
+
+Every request method of EngineApiClient is mirrored here but instead
+of blocking until the response arrives each call returns immediately
+with a multiprocessing.pool.AsyncResult. The iter* methods and
+openStream, which return objects driven by the caller, are not. The
+requests are run by a bounded pool of worker threads sharing a single
+EngineApiClient and its keep-alive connection pool, so many requests
+to many jobs can be in flight at once.
+
+    client = AsyncEngineApiClient('localhost', 'engine/v2', workers=64)
+    pending = [client.getBuckets(job_id) for job_id in job_ids]
+    for result in pending:
+        (http_status_code, response) = result.get()
+
+The result's get() method re-raises any exception thrown by the request.
+Every method also accepts an optional 'callback' keyword argument, a
+function called with the method's result, usually the
+(http_status_code, response) tuple, when the request completes
+successfully. Callbacks run on an internal thread and must not block.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+from .EngineApiClient import EngineApiClient
+
+# The EngineApiClient methods mirrored by AsyncEngineApiClient,
+# stream() has a different signature and is defined separately
+ASYNC_METHODS = (
+    'getJob', 'getJobs', 'createJob', 'updateJob', 'pauseJob', 'resumeJob',
+    'upload', 'uploadFile', 'close', 'flush', 'preview', 'getBucket', 'getBuckets',
+    'getBucketsByDate', 'getAllBuckets', 'getRecords', 'getCategoryDefinitions',
+    'getCategoryDefinition', 'getInfluencers', 'alerts_longpoll', 'delete',
+    'deleteJobs', 'getZippedLogs', 'getJobLog', 'getElasticsearchServerLogs',
+    'getEngineApiServerLogs', 'getModelSnapshots', 'revertToSnapshot',
+    'updateModelSnapshotDescription', 'deleteModelSnapshot', 'startScheduler',
+    'stopScheduler', 'validateDetector', 'validateTransform', 'validateTransforms'
+)
+
+class AsyncEngineApiClient:
+
+
+    def __init__(self, host, base_url, port=8080, workers=16, idle_timeout=15,
+            compression_level=None):
+        """
+        Create an asynchronous client for the API at host:port
+        host is the host machine
+        base_url is the API URl this should contain the version number
+          e.g. /engine/v2
+        The default port is 8080
+        workers is the maximum number of requests in flight at once,
+          the same number of keep-alive connections are pooled
+        idle_timeout is the number of seconds an unused connection is
+          kept in the pool before it is closed
+        compression_level if set uploaded data is gzip compressed at
+          this level, see EngineApiClient
+        """
+        self.client = EngineApiClient(host, base_url, port, pool_size=workers,
+            idle_timeout=idle_timeout, max_connections=workers,
+            compression_level=compression_level)
+        self.workers = ThreadPool(workers)
+
+
+    def stream(self, job_id, records, gzipped=False, callback=None):
+        """
+        Upload the records using chunked transfer encoding.
+        records is an iterable of strings, a generator for example,
+        each one is written to the upload stream as it is produced.
+        CSV records must end in a newline character.
+
+        Returns an AsyncResult for the (http_status_code, response)
+        tuple, if http_status_code != 202 response is an error object.
+        """
+        return self.workers.apply_async(self._streamRecords,
+            (job_id, records, gzipped), {}, callback)
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting new requests. If wait is True block until the
+        outstanding requests have completed. The pooled connections
+        are then closed.
+        """
+        self.workers.close()
+        if wait:
+            self.workers.join()
+            self.client.pool.clear()
+
+    def _streamRecords(self, job_id, records, gzipped):
+        consumer = None
+        for record in records:
+            # an empty string would end the chunked upload early
+            if not record:
+                continue
+
+            if consumer is None:
+                consumer = self.client.stream(job_id, record, gzipped)
+                consumer.send(None)
+            else:
+                consumer.send(record)
+
+        if consumer is None:
+            return self.client.upload(job_id, '', gzipped)
+
+        return consumer.send('')
+
+
+def _asyncMethod(name):
+    """
+    Return a method that runs EngineApiClient.<name> on the worker
+    pool and returns the AsyncResult.
+    """
+    def method(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self.workers.apply_async(getattr(self.client, name), args,
+            kwargs, callback)
+
+    method.__name__ = name
+    method.__doc__ = ("\n        Asynchronous EngineApiClient." + name +
+        ", returns an AsyncResult\n        for the value described below.\n" +
+        getattr(EngineApiClient, name).__doc__)
+    return method
+
+for _name in ASYNC_METHODS:
+    setattr(AsyncEngineApiClient, _name, _asyncMethod(_name))
@@ -0,0 +1,301 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Buffered writer for uploading data to the Engine API with chunked
+transfer encoding. Records are collected until either chunk_size bytes
+are buffered or, when the next record is written, max_delay seconds
+have passed since the first buffered record, the buffer is then written
+to the socket as one HTTP chunk in a single send. There is no timer, a
+writer that pauses between records should call flush() before pausing.
+If a compression level is set the data is gzip compressed
+incrementally as it is written.
+
+    with engine_client.openStream(job_id) as uploader:
+        uploader.write(header)
+        for record in records:
+            uploader.write(record)
+    (http_status_code, response) = uploader.result
+"""
+
+import itertools
+import json
+import logging
+import select
+import socket
+import time
+import zlib
+
+# writelines() joins this many records into each write,
+# one write per record costs more than the copy
+RECORDS_PER_WRITE = 500
+
+class ChunkedUploader:
+
+
+    def __init__(self, pool, url, gzipped=False, chunk_size=65536, max_delay=1.0,
+            compression_level=None):
+        """
+        pool is the ConnectionPool the connection is taken from
+        url is the data endpoint URL
+        If the data is gzipped compressed set gzipped to True
+        chunk_size is the number of bytes buffered before a chunk is
+          sent, if 0 every write is sent immediately
+        max_delay is the maximum number of seconds a record is buffered
+          before being sent if more records follow. The delay is only
+          checked when a record is written, a partly filled chunk waits
+          for the next write however long that takes. Call flush() to
+          send buffered data explicitly.
+        compression_level if not None the zlib compression level (1-9)
+          used to gzip the data as it is written. Must not be set if
+          the data is already gzipped.
+        """
+        self.pool = pool
+        self.url = url
+        self.gzipped = gzipped
+        self.chunk_size = chunk_size
+        self.max_delay = max_delay
+        self.compression_level = compression_level
+
+        # The (http_status_code, response) tuple once the upload is closed
+        self.result = None
+        # Set if a send failed or was interrupted part way through a
+        # chunk, the request can then only be aborted
+        self.broken = False
+
+        # The number of write() calls, a call may hold many records
+        self.writes = 0
+        # bytes_written counts the data before compression
+        self.bytes_written = 0
+        self.bytes_sent = 0
+        self.chunks_sent = 0
+        # Total time spent blocked waiting for the socket to accept data
+        self.send_wait = 0.0
+
+        self._connection = None
+        self._compressor = None
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._first_buffered_at = None
+
+
+    def __enter__(self):
+        if self._connection is None:
+            self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        """
+        Take a connection from the pool and send the request headers
+        """
+        self._connection = self.pool.acquire()
+        try:
+            if self._connection.sock is None:
+                self._connection.connect()
+            # Chunks are sent as soon as they are ready, don't let Nagle's
+            # algorithm hold back the end of a chunk waiting for an ACK
+            self._connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            self._connection.putrequest("POST", self.url)
+            self._connection.putheader("Connection", "Keep-Alive")
+            self._connection.putheader("Transfer-Encoding", "chunked")
+            self._connection.putheader("Content-Type", "application/x-www-form-urlencoded")
+            if self.gzipped or self.compression_level:
+                self._connection.putheader('Content-Encoding', 'gzip')
+            self._connection.endheaders()
+        except:
+            self.abort()
+            raise
+
+        if self.compression_level:
+            # wbits of 16 + MAX_WBITS writes the gzip header and trailer
+            self._compressor = zlib.compressobj(self.compression_level,
+                zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        """
+        Buffer data (a string) for upload, CSV records must end in a
+        newline character. A chunk is sent when the buffer is full or
+        max_delay has expired.
+        """
+        if not data:
+            return
+
+        if self._first_buffered_at is None:
+            self._first_buffered_at = time.time()
+
+        self.writes += 1
+        self.bytes_written += len(data)
+
+        if self._compressor:
+            # the compressor holds on to data until it has
+            # enough to emit a block, it may return nothing
+            data = self._compressor.compress(data)
+
+        self._append(data)
+
+        if time.time() - self._first_buffered_at >= self.max_delay:
+            self.flush()
+        elif self._buffered_bytes >= self.chunk_size:
+            self._sendChunk()
+
+    def writelines(self, records):
+        """
+        Write each record in the iterable records, they are joined
+        into blocks of RECORDS_PER_WRITE records for each write
+        so records can be passed one at a time from a generator
+        """
+        records = iter(records)
+        block = list(itertools.islice(records, RECORDS_PER_WRITE))
+        while block:
+            self.write(''.join(block))
+            block = list(itertools.islice(records, RECORDS_PER_WRITE))
+
+    def flush(self):
+        """
+        Send all the data written so far. If compressing, the
+        compressor is flushed so the Engine can decompress every
+        record sent.
+        """
+        if self._compressor:
+            self._append(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+        self._sendChunk()
+        self._first_buffered_at = None
+
+    def isCongested(self):
+        """
+        Back-pressure check, returns True if the socket's send buffer
+        is full and the next chunk would block until the Engine has
+        read more data.
+        """
+        sock = self._connection.sock
+        (readable, writable, errored) = select.select([], [sock], [], 0)
+        return len(writable) == 0
+
+    def stats(self):
+        """
+        Return a dictionary of the upload statistics. send_wait is the
+        number of seconds spent blocked sending, a value growing with
+        elapsed time means the Engine is not keeping up.
+        """
+        return {'writes' : self.writes, 'bytes_written' : self.bytes_written,
+            'bytes_sent' : self.bytes_sent,
+            'chunks_sent' : self.chunks_sent, 'send_wait' : self.send_wait,
+            'buffered_bytes' : self._buffered_bytes}
+
+    def close(self, expects_json=True):
+        """
+        Send any buffered data, end the upload and read the response.
+        Returns a (http_status_code, response) tuple, if
+        http_status_code != 202 response is an error object. The
+        tuple is also stored in the result attribute.
+        If expects_json is False the response data is not parsed.
+        If the upload is broken IOError is raised and the upload
+        aborted, check the broken attribute first to avoid this.
+        """
+        try:
+            if self._compressor:
+                self._append(self._compressor.flush())
+            self._sendChunk()
+
+            # End chunked transfer encoding by sending the zero length message
+            self._send('0\r\n\r\n')
+
+            response = self._connection.getresponse()
+            if response.status != 202:
+                logging.error("Upload stream response = " + str(response.status)
+                    + " " + response.reason)
+            else:
+                logging.debug("Upload stream response = " + str(response.status))
+
+            # read all of the response before another request can be made
+            data = response.read()
+        except:
+            self.abort()
+            raise
+
+        self.pool.release(self._connection, not response.will_close)
+        self._connection = None
+
+        if not expects_json:
+            self.result = (response.status, data)
+        elif data:
+            self.result = (response.status, json.loads(data))
+        else:
+            self.result = (response.status, dict())
+
+        return self.result
+
+    def abort(self):
+        """
+        Abandon the upload, the connection is closed as the
+        request was not completed.
+        """
+        if self._connection is not None:
+            self.pool.release(self._connection, False)
+            self._connection = None
+
+    def _append(self, data):
+        if data:
+            self._buffer.append(data)
+            self._buffered_bytes += len(data)
+
+    def _sendChunk(self):
+        """
+        Send the buffered data as a single chunk
+        """
+        if not self._buffered_bytes:
+            return
+
+        # The chunk size in hex then the data, joined so the
+        # whole chunk is copied once and sent in one call
+        chunk = ['%x\r\n' % self._buffered_bytes]
+        chunk.extend(self._buffer)
+        chunk.append('\r\n')
+        self._send(''.join(chunk))
+
+        self.bytes_sent += self._buffered_bytes
+        self.chunks_sent += 1
+        self._buffer = []
+        self._buffered_bytes = 0
+        if not self._compressor:
+            self._first_buffered_at = None
+
+    def _send(self, msg):
+        """
+        Send msg, if the send fails or is interrupted an unknown part
+        of msg has been sent and the chunked framing is lost so the
+        upload is marked broken and nothing more may be sent
+        """
+        if self.broken:
+            raise IOError("Upload to " + self.url + " is broken by an incomplete send")
+
+        start = time.time()
+        try:
+            self._connection.sock.sendall(msg)
+        except:
+            self.broken = True
+            raise
+        finally:
+            self.send_wait += time.time() - start
@@ -0,0 +1,135 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+A bounded pool of persistent HTTP/1.1 connections to a single host:port.
+The pool is thread safe, each thread checks a connection out for the
+duration of a request and returns it when the response has been read.
+"""
+
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+
+class ConnectionPool:
+
+
+    def __init__(self, host, port, max_size=4, idle_timeout=15, max_connections=None):
+        """
+        Create an empty pool for connections to host:port
+        max_size is the maximum number of idle connections kept open
+          for reuse, connections released when the pool is full are closed
+        idle_timeout is the number of seconds a connection may sit unused
+          in the pool before it is discarded. This should be less than
+          the server's keep-alive timeout.
+        max_connections if not None is the maximum number of connections
+          that may be checked out at once, acquire() blocks until a
+          connection is released when the limit is reached.
+        """
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+
+        # (connection, time released) pairs, the most recently used last
+        self._idle = []
+        self._checked_out = 0
+        self._condition = threading.Condition()
+
+
+    def acquire(self):
+        """
+        Return an open connection from the pool if a healthy one is
+        available else a new, unconnected, HTTPConnection. The caller
+        must give the connection back with release() when the response
+        has been read, or if the request failed.
+        """
+        with self._condition:
+            if self.max_connections:
+                while self._checked_out >= self.max_connections:
+                    self._condition.wait()
+            self._checked_out += 1
+
+            now = time.time()
+            while self._idle:
+                (connection, released_at) = self._idle.pop()
+                if now - released_at < self.idle_timeout and not self._isStale(connection):
+                    return connection
+
+                logging.debug("Discarding stale connection to {0}:{1}".format(
+                    self.host, self.port))
+                connection.close()
+
+        return httplib.HTTPConnection(self.host, self.port)
+
+    def release(self, connection, reusable=True):
+        """
+        Return the connection to the pool. If reusable is False, the
+        connection is not open or the pool is full the connection is
+        closed instead.
+        """
+        with self._condition:
+            self._checked_out -= 1
+            self._condition.notify()
+
+            self._expire(time.time())
+
+            if not reusable or connection.sock is None or len(self._idle) >= self.max_size:
+                connection.close()
+                return
+
+            self._idle.append((connection, time.time()))
+
+    def clear(self):
+        """
+        Close all the idle connections
+        """
+        with self._condition:
+            while self._idle:
+                (connection, released_at) = self._idle.pop()
+                connection.close()
+
+    def _expire(self, now):
+        """
+        Close the connections that have been idle for longer than
+        idle_timeout, the oldest are at the front of the list.
+        Must be called with the lock held.
+        """
+        while self._idle and now - self._idle[0][1] >= self.idle_timeout:
+            (connection, released_at) = self._idle.pop(0)
+            connection.close()
+
+    def _isStale(self, connection):
+        """
+        An idle keep-alive connection should have nothing to read. If
+        the socket is readable the server has either closed it or sent
+        unexpected data, in both cases it cannot be reused.
+        """
+        sock = connection.sock
+        if sock is None:
+            return True
+
+        try:
+            (readable, writable, errored) = select.select([sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+
+        return len(readable) > 0
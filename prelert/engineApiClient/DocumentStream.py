@@ -0,0 +1,152 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Incremental decoder for the paged results documents returned by the
+Engine API. A page has the form
+
+    {"hitCount" : 1000, "skip" : 0, "take" : 100, "nextPage" : "...",
+     "documents" : [ {...}, {...}, ... ] }
+
+The documents array is decoded one element at a time as the data is
+read from the file object so only one document is held in memory at
+once rather than the whole page.
+"""
+
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class DocumentStream:
+
+
+    def __init__(self, fp, chunk_size=65536):
+        """
+        fp is a file like object with a read(size) method, for example
+        a httplib.HTTPResponse.
+        chunk_size is the minimum number of bytes read at a time
+
+        Iterating the DocumentStream yields each element of the
+        'documents' array. The other top level fields of the page
+        are stored in the fields dictionary as they are decoded, those
+        after the documents array are only available once iteration
+        has finished.
+        """
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.fields = dict()
+
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            key = self._decodeValue()
+            self._expect(':')
+            if key == 'documents':
+                for document in self._iterArray():
+                    yield document
+            else:
+                self.fields[key] = self._decodeValue()
+
+            if self._expect(',}') == '}':
+                return
+
+    def _iterArray(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._decodeValue()
+            if self._expect(',]') == ']':
+                return
+
+    def _fill(self):
+        """
+        Discard the consumed part of the buffer and append more data.
+        The read size grows with the unconsumed data so decoding a
+        document larger than chunk_size does not become quadratic.
+        Returns False at the end of the stream.
+        """
+        if self._eof:
+            return False
+
+        data = self.fp.read(max(self.chunk_size, len(self._buffer) - self._pos))
+        if not data:
+            self._eof = True
+            return False
+
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """
+        Skip whitespace and return the next character
+        or '' at the end of the stream
+        """
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        """
+        Consume the next non-whitespace character which must be one
+        of chars and return it else raise a ValueError
+        """
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError("Expecting one of '{0}' in results document, found '{1}'".format(
+                chars, c))
+
+        self._pos += 1
+        return c
+
+    def _decodeValue(self):
+        """
+        Decode the JSON value starting at the current position,
+        reading more data until the value is complete.
+        """
+        self._peek()
+        while True:
+            try:
+                (value, end) = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+
+            # a number at the very end of the buffer may have been cut short
+            if end == len(self._buffer) and self._fill():
+                continue
+
+            self._pos = end
+            return value
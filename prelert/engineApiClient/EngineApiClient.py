@@ -23,17 +23,88 @@ import httplib
 import urllib
 import json
 import logging
+import mmap
+import os
+import socket
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from .ChunkedUploader import ChunkedUploader
+from .ConnectionPool import ConnectionPool
+from .DocumentStream import DocumentStream
+
+# Size of the blocks read from a file object when compressing it for upload
+UPLOAD_BLOCK_SIZE = 65536
+
+# Requests that can be sent again if the server may already have
+# processed them without the response being received
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+
+# The number of times a request failing on a reused pooled
+# connection is retried on another connection
+STALE_CONNECTION_RETRIES = 1
+
+class EngineApiError(Exception):
+    """
+    Raised by the result iterators when a request fails.
+    http_status_code is the response status and error_doc the
+    error document returned by the API.
+    """
+
+    def __init__(self, http_status_code, error_doc):
+        Exception.__init__(self, "Engine API response = {0} {1}".format(
+            http_status_code, json.dumps(error_doc)))
+        self.http_status_code = http_status_code
+        self.error_doc = error_doc
+
+
+class _RateLimiter:
+    """
+    Spaces out calls to wait() from any number of threads
+    so no more than rate calls return per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
 
 class EngineApiClient:
 
 
-    def __init__(self, host, base_url, port=8080):
+    def __init__(self, host, base_url, port=8080, pool_size=4, idle_timeout=15,
+            max_connections=None, compression_level=None):
         """
-        Create a HTTP connection to host:port
+        Create a client for the API at host:port
         host is the host machine
         base_url is the API URl this should contain the version number
           e.g. /engine/v2
         The default port is 8080
+        pool_size is the maximum number of idle keep-alive connections
+          held open for reuse between requests
+        idle_timeout is the number of seconds an unused connection is
+          kept in the pool before it is closed
+        max_connections limits the number of requests in flight at once
+          when the client is shared between threads, None means no limit
+        compression_level if set the data sent by upload, preview, stream
+          and openStream is gzip compressed on the fly at this zlib level
+          (1 fastest - 9 best) unless the caller says it is already
+          gzipped. None or 0 means the data is sent uncompressed.
+
+        Each call checks a connection out of the pool for the duration
+        of the request so a single client can be shared by many threads.
         """
         self.host = host
 
@@ -44,7 +115,8 @@ class EngineApiClient:
         logging.info("Connecting to Engine REST API at {0}:{1}{2}".format(host,
             port, base_url))
         self.base_url = base_url
-        self.connection = httplib.HTTPConnection(host, port)
+        self.pool = ConnectionPool(host, port, pool_size, idle_timeout, max_connections)
+        self.compression_level = compression_level
 
 
     def getJob(self, job_id):
@@ -122,7 +194,9 @@ class EngineApiClient:
         """
         Upload data to the jobs data endpoint.
         Data can be a string or an open file object.
-        If the data is gzipped compressed set gzipped to True
+        If the data is gzipped compressed set gzipped to True, otherwise
+        if the client has a compression_level the data is compressed
+        before it is sent.
 
         Returns a (http_status_code, response_data) tuple, if
         http_status_code != 202 response_data is an error message.
@@ -137,6 +211,64 @@ class EngineApiClient:
 
         return (status, doc)
 
+    def uploadFile(self, job_id, path, gzipped=False, store=False, part_size=None,
+            csv_header=False):
+        """
+        Upload the file at path to the jobs data endpoint. The file is
+        memory mapped and written to the socket straight from the
+        mapping with a Content-Length header, it is not read into a
+        string first. The client's compression_level is not applied,
+        the file is sent as it is on disk.
+        If the file is gzipped compressed set gzipped to True.
+
+        part_size if set the file is split into parts of about this
+          many bytes, each part ends at a record (newline) boundary and
+          is uploaded as a separate request. The parts are uploaded one
+          after another as the Engine expects a job's data in time
+          order. Gzipped files are never split.
+        csv_header if True the first line of the file is a CSV header
+          and it is sent at the start of every part
+
+        Returns the (http_status_code, response) tuple of the last part
+        uploaded. If a part fails the remaining parts are not sent and
+        response is the error object.
+        """
+        endpoint = 'dataload' if store else 'data'
+        url = self.base_url + "/" + endpoint + "/" + job_id
+
+        headers = {'Content-Type' : 'application/x-www-form-urlencoded'}
+        if gzipped:
+            headers['Content-Encoding'] = 'gzip'
+            part_size = None
+
+        with open(path, 'rb') as data_file:
+            size = os.fstat(data_file.fileno()).st_size
+            if size == 0:
+                # an empty file cannot be mapped
+                return self._uploadPart(url, endpoint, [], 0, headers)
+            mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            header = ''
+            if csv_header and part_size:
+                header_end = mapped.find('\n')
+                header = mapped[:header_end + 1] if header_end >= 0 else mapped[:]
+
+            for (start, end) in self._recordParts(mapped, size, part_size):
+                # buffer() slices the mapping without copying it
+                body = [buffer(mapped, start, end - start)]
+                if start > 0 and header:
+                    body.insert(0, header)
+
+                (status, doc) = self._uploadPart(url, endpoint, body,
+                    len(header) * (len(body) - 1) + end - start, headers)
+                if status != 202:
+                    break
+        finally:
+            mapped.close()
+
+        return (status, doc)
+
 
     def stream(self, job_id, data, gzipped=False):
         """
@@ -162,54 +294,58 @@ class EngineApiClient:
 
             (http_status, response) = consumer.send('')
 
+        Every record is sent in its own chunk, for higher throughput use
+        openStream which batches records into larger chunks.
         """
 
-        url = self.base_url + "/data/" + job_id
-
-        self.connection.connect()
-
-        self.connection.putrequest("POST", url)
-        self.connection.putheader("Connection", "Keep-Alive")
-        self.connection.putheader("Transfer-Encoding", "chunked")
-        self.connection.putheader("Content-Type", "application/x-www-form-urlencoded")
-        if gzipped:
-            self.connection.putheader('Content-Encoding', 'gzip')
-        self.connection.endheaders()
-
-        while data:
-            # Send in chunked transfer encoding format. Write the hexidecimal
-            # length of the data message followed by '\r\n' followed by the
-            # data and another '\r\n'
-
-            # strip the '0x' of the hex string
-            data_len = hex(len(data))[2:]
-            msg = data_len + '\r\n' + data + '\r\n'
+        uploader = ChunkedUploader(self.pool, self.base_url + "/data/" + job_id,
+            gzipped, chunk_size=0, compression_level=self._compressionLevel(gzipped))
+        uploader.open()
+        try:
+            while data:
+                uploader.write(data)
+                data = yield
 
-            self.connection.send(msg)
-            data = yield
+            result = uploader.close()
+        except:
+            # the stream was abandoned or failed part way through
+            # the connection is in an unknown state
+            uploader.abort()
+            raise
 
-        # End chunked transfer encoding by sending the zero length message
-        msg = '0\r\n\r\n'
-        self.connection.send(msg)
-
-        response = self.connection.getresponse();
-        if response.status != 202:
-            logging.error("Upload file response = " + str(response.status)
-                + " " + response.reason)
-        else:
-            logging.debug("Upload response = " + str(response.status))
+        yield result
 
+    def openStream(self, job_id, gzipped=False, chunk_size=65536, max_delay=1.0):
+        """
+        Open a buffered upload stream to the job using chunked transfer
+        encoding. Records written to the stream are packed into chunks
+        of up to chunk_size bytes, a chunk is also sent by the first
+        write() after its first record has been buffered for max_delay
+        seconds. Nothing is sent between writes, call flush() on the
+        stream before waiting for more data so the records buffered so
+        far are not held back.
+        If the data is gzipped compressed set gzipped to True, otherwise
+        if the client has a compression_level the stream is compressed
+        as it is written.
 
-        # read all of the response before another request can be made
-        data = response.read()
-        if data:
-            doc = json.loads(data)
-        else:
-            doc = dict()
+        The returned ChunkedUploader is a context manager, the upload is
+        completed when the with block exits and the (http_status_code,
+        response) tuple is then available as the result attribute.
 
-        self.connection.close()
+            with engine_client.openStream(job_id) as uploader:
+                for record in records:
+                    uploader.write(record)
+            (http_status_code, response) = uploader.result
 
-        yield (response.status, doc)
+        The stream can also be used without a with block by calling
+        close(), which returns the (http_status_code, response) tuple.
+        uploader.stats() and uploader.isCongested() report how well the
+        Engine is keeping up with the upload.
+        """
+        uploader = ChunkedUploader(self.pool, self.base_url + "/data/" + job_id,
+            gzipped, chunk_size, max_delay, self._compressionLevel(gzipped))
+        uploader.open()
+        return uploader
 
 
     def close(self, job_id):
@@ -261,7 +397,9 @@ class EngineApiClient:
         is text/csv preview of the uploaded data after the transforms
         have been applied.
         Data can be a string or an open file object.
-        If the data is gzipped compressed set gzipped to True
+        If the data is gzipped compressed set gzipped to True, otherwise
+        if the client has a compression_level the data is compressed
+        before it is sent.
 
         Returns a (http_status_code, response_data) tuple, if
         http_status_code != 202 response_data is an error message.
@@ -298,7 +436,7 @@ class EngineApiClient:
 
     def getBuckets(self, job_id, skip=0, take=100, include_records=False,
                 normalized_probability_filter_value=None, anomaly_score_filter_value=None,
-                include_interim=False):
+                include_interim=False, start_date=None, end_date=None):
         '''
         Return a page of the job's buckets results.
         skip the first N buckets
@@ -309,12 +447,23 @@ class EngineApiClient:
         anomaly_score_filter_value If not none return only the records with
             an anomalyScore >= anomaly_score_filter_value
         include_interim Should interim results be returned as well as final results?
+        start_date, end_date If set must either be an epoch time or ISO 8601
+            format strings see the Prelert Engine API docs for help.
 
         Returns a (http_status_code, buckets) tuple if successful else
         if http_status_code != 200 a (http_status_code, error_doc) is
         returned
         '''
 
+        url = self._bucketsUrl(job_id, skip, take, include_records, normalized_probability_filter_value,
+            anomaly_score_filter_value, include_interim, start_date, end_date)
+        return self._get(url, "buckets")
+
+    def _bucketsUrl(self, job_id, skip, take, include_records, normalized_probability_filter_value,
+            anomaly_score_filter_value, include_interim, start_date, end_date):
+        """
+        Return the URL of a page of the job's buckets
+        """
         query = ''
         if include_records:
             query = '&expand=true'
@@ -328,20 +477,26 @@ class EngineApiClient:
         if anomaly_score_filter_value:
             query += '&anomalyScore=' + str(anomaly_score_filter_value)
 
-        url = self.base_url + "/results/{0}/buckets?skip={1}&take={2}{3}".format(
-            job_id, skip, take, query)
+        if start_date:
+            query += '&start=' + urllib.quote(start_date)
 
-        return self._get(url, "buckets")
+        if end_date:
+            query += '&end=' + urllib.quote(end_date)
+
+        return self.base_url + "/results/{0}/buckets?skip={1}&take={2}{3}".format(
+            job_id, skip, take, query)
 
 
     def getBucketsByDate(self, job_id, start_date, end_date, include_records=False,
             normalized_probability_filter_value=None, anomaly_score_filter_value=None,
-            include_interim=False):
+            include_interim=False, take=100, prefetch=4):
         """
         Return all the job's buckets results between 2 dates.  If there is more
         than one page of results for the given data range this function will
         get them all appending the buckets in a list. A list of buckets is
         returned.
+        Once the first page has been read the remaining pages are requested
+        concurrently, see getAllBuckets.
 
         start_date, end_date Must either be an epoch time or ISO 8601 format
         strings see the Prelert Engine API docs for help.
@@ -351,14 +506,14 @@ class EngineApiClient:
         anomaly_score_filter_value If not none return only the records with
             an anomalyScore >= anomaly_score_filter_value
         include_interim Should interim results be returned as well as final results?
+        take The number of buckets requested in each page
+        prefetch The maximum number of pages requested concurrently
 
         Returns a (http_status_code, buckets) tuple if successful else
         if http_status_code != 200 a (http_status_code, error_doc) is
         returned
         """
 
-        skip = 0
-        take = 100
         expand = ''
         if include_records:
             expand = '&expand=true'
@@ -382,57 +537,23 @@ class EngineApiClient:
         if include_interim:
             include_interim_arg = '&includeInterim=true'
 
-        url = self.base_url + "/results/{0}/buckets?skip={1}&take={2}{3}{4}{5}{6}{7}".format(job_id,
-            skip, take, expand, start_arg, end_arg, score_filter, include_interim_arg)
+        url = self.base_url + "/results/{0}/buckets?skip={{0}}&take={{1}}{1}{2}{3}{4}{5}".format(
+            job_id, expand, start_arg, end_arg, score_filter, include_interim_arg)
 
-        self.connection.connect()
-        self.connection.request("GET", url)
-        response = self.connection.getresponse();
-
-        if response.status != 200:
-            logging.error("Get buckets by date response = " + str(response.status) + " " + response.reason)
-            response_data = json.load(response)
-            return (response.status, response_data)
-        else:
-            logging.debug("Get buckets by date response = " + str(response.status))
-
-
-        result = json.load(response)
-        buckets = result['documents']
-
-        # is there another page of results
-        while result['nextPage']:
-            skip += take
-            url = self.base_url + "/results/{0}/buckets?skip={1}&take={2}{3}{4}{5}".format(job_id,
-                                skip, take, expand, start_arg, end_arg)
-            self.connection.request("GET", url)
-            response = self.connection.getresponse();
-            if response.status != 200:
-                logging.error("Get buckets by date response = " + str(response.status) + " " + response.reason)
-                message = json.load(response)
-
-                if message:
-                    message = json.loads(message)
-
-                self.connection.close()
-                return (response.status, message)
-
-            result = json.load(response)
-            buckets.extend(result['documents'])
-
-        self.connection.close()
-
-        return (200, buckets)
+        return self._getAllPages(url, "buckets by date", take, prefetch)
 
 
     def getAllBuckets(self, job_id, include_records=False,
                 normalized_probability_filter_value=None, anomaly_score_filter_value=None,
-                include_interim=False):
+                include_interim=False, take=100, prefetch=4):
         """
         Return all the job's buckets results.  If more than 1
         page of buckets are available continue to with the next
         page until all results have been read. An array of buckets is
         returned.
+        The first page gives the total number of buckets, the remaining
+        pages are then requested with up to prefetch requests in flight
+        at once and the buckets are returned in order.
 
         include_records Anomaly records are included in the buckets
         normalized_probability_filter_value If not none return only the records with
@@ -440,14 +561,15 @@ class EngineApiClient:
         anomaly_score_filter_value If not none return only the records with
             an anomalyScore >= anomaly_score_filter_value
         include_interim Should interim results be returned as well as final results?
+        take The number of buckets requested in each page
+        prefetch The maximum number of pages requested concurrently,
+            if 1 the pages are read one after another
 
         Returns a (http_status_code, buckets) tuple if successful else
         if http_status_code != 200 a (http_status_code, error_doc) tuple
         is returned
         """
 
-        skip = 0
-        take = 100
         expand = ''
         if include_records:
             expand = '&expand=true'
@@ -463,49 +585,35 @@ class EngineApiClient:
         if include_interim:
             include_interim_arg = '&includeInterim=true'
 
-        url = self.base_url + "/results/{0}/buckets?skip={1}&take={2}{3}{4}{5}".format(
-            job_id, skip, take, expand, score_filter, include_interim_arg)
-
-
-        self.connection.connect()
-        self.connection.request("GET", url)
-        response = self.connection.getresponse();
-
-        if response.status != 200:
-            logging.error("Get all buckets response = " + str(response.status) + " " + response.reason)
-            response_data = json.load(response)
-            return (response.status, response_data)
-        else:
-            logging.debug("Get all buckets response = " + str(response.status))
-
+        url = self.base_url + "/results/{0}/buckets?skip={{0}}&take={{1}}{1}{2}{3}".format(
+            job_id, expand, score_filter, include_interim_arg)
 
-        result = json.load(response)
-        buckets = result['documents']
+        return self._getAllPages(url, "all buckets", take, prefetch)
 
-        # is there another page of results
-        while result['nextPage']:
-            skip += take
-            url = self.base_url + "/results/{0}/buckets?skip={1}&take={2}{3}{4}".format(
-                job_id, skip, take, expand, score_filter)
-
-            self.connection.request("GET", url)
-            response = self.connection.getresponse();
-            if response.status != 200:
-                logging.error("Get all buckets response = " + str(response.status) + " " + response.reason)
-
-                message = json.load(response)
-                if message:
-                    message = json.loads(message)
-
-                self.connection.close()
-                return (response.status, message)
+    def iterBuckets(self, job_id, start_date=None, end_date=None, include_records=False,
+            normalized_probability_filter_value=None, anomaly_score_filter_value=None,
+            include_interim=False, take=100, stream_decode=False):
+        """
+        Generator yielding the job's buckets one at a time. Only one page
+        of take buckets is held in memory at once and the next page is not
+        requested until the current one has been consumed, so stopping
+        the iteration early does not read the remaining results.
 
-            result = json.load(response)
-            buckets.extend(result['documents'])
+        The arguments are the same as getBucketsByDate, if start_date and
+        end_date are None all the buckets are returned.
+        If stream_decode is True each bucket is decoded and yielded as
+        it is read from the socket, memory use is then bounded by the
+        size of one bucket rather than one page. This is useful for
+        large pages or when include_records is True.
 
-        self.connection.close()
+        Raises EngineApiError if a request fails.
+        """
+        def pageUrl(skip, take):
+            return self._bucketsUrl(job_id, skip, take, include_records,
+                normalized_probability_filter_value, anomaly_score_filter_value,
+                include_interim, start_date, end_date)
 
-        return (200, buckets)
+        return self._iterPages(pageUrl, "buckets", take, stream_decode)
 
 
     def getRecords(self, job_id, skip=0, take=100, start_date=None,
@@ -534,6 +642,17 @@ class EngineApiClient:
         returned
         """
 
+        url = self._recordsUrl(job_id, skip, take, start_date, end_date, sort_field,
+            sort_descending, normalized_probability_filter_value, anomaly_score_filter_value,
+            include_interim)
+        return self._get(url, "records")
+
+    def _recordsUrl(self, job_id, skip, take, start_date, end_date, sort_field,
+            sort_descending, normalized_probability_filter_value, anomaly_score_filter_value,
+            include_interim):
+        """
+        Return the URL of a page of the job's records
+        """
         start_arg = ''
         if start_date:
             start_arg = '&start=' + urllib.quote(start_date)
@@ -557,10 +676,28 @@ class EngineApiClient:
         if include_interim:
             include_interim_arg = '&includeInterim=true'
 
-        url = self.base_url + "/results/{0}/records?skip={1}&take={2}{3}{4}{5}{6}{7}".format(
+        return self.base_url + "/results/{0}/records?skip={1}&take={2}{3}{4}{5}{6}{7}".format(
             job_id, skip, take, start_arg, end_arg, sort_arg, filter_arg, include_interim_arg)
 
-        return self._get(url, "records")
+    def iterRecords(self, job_id, start_date=None, end_date=None, sort_field=None,
+            sort_descending=True, normalized_probability_filter_value=None,
+            anomaly_score_filter_value=None, include_interim=False, take=100,
+            stream_decode=False):
+        """
+        Generator yielding the job's anomaly records one at a time, a page
+        of take records is requested each time the previous page has been
+        consumed. The arguments are the same as getRecords.
+        If stream_decode is True the records are decoded one at a time as
+        they are read from the socket rather than a page at a time.
+
+        Raises EngineApiError if a request fails.
+        """
+        def pageUrl(skip, take):
+            return self._recordsUrl(job_id, skip, take, start_date, end_date,
+                sort_field, sort_descending, normalized_probability_filter_value,
+                anomaly_score_filter_value, include_interim)
+
+        return self._iterPages(pageUrl, "records", take, stream_decode)
 
 
     def getCategoryDefinitions(self, job_id):
@@ -605,6 +742,15 @@ class EngineApiClient:
         returned
         """
 
+        url = self._influencersUrl(job_id, skip, take, start_date, end_date, sort_field,
+            sort_descending, anomaly_score_filter_value, include_interim)
+        return self._get(url, "influencers")
+
+    def _influencersUrl(self, job_id, skip, take, start_date, end_date, sort_field,
+            sort_descending, anomaly_score_filter_value, include_interim):
+        """
+        Return the URL of a page of the job's influencers
+        """
         start_arg = ''
         if start_date:
             start_arg = '&start=' + urllib.quote(start_date)
@@ -625,10 +771,26 @@ class EngineApiClient:
         if include_interim:
             include_interim_arg = '&includeInterim=true'
 
-        url = self.base_url + '/results/{0}/influencers?skip={1}&take={2}{3}{4}{5}{6}{7}'.format(
+        return self.base_url + '/results/{0}/influencers?skip={1}&take={2}{3}{4}{5}{6}{7}'.format(
             job_id, skip, take, start_arg, end_arg, sort_arg, filter_arg, include_interim_arg)
 
-        return self._get(url, "influencers")
+    def iterInfluencers(self, job_id, start_date=None, end_date=None, sort_field=None,
+            sort_descending=True, anomaly_score_filter_value=None, include_interim=False,
+            take=100, stream_decode=False):
+        """
+        Generator yielding the job's influencers one at a time, a page of
+        take influencers is requested each time the previous page has been
+        consumed. The arguments are the same as getInfluencers.
+        If stream_decode is True the influencers are decoded one at a time
+        as they are read from the socket rather than a page at a time.
+
+        Raises EngineApiError if a request fails.
+        """
+        def pageUrl(skip, take):
+            return self._influencersUrl(job_id, skip, take, start_date, end_date,
+                sort_field, sort_descending, anomaly_score_filter_value, include_interim)
+
+        return self._iterPages(pageUrl, "influencers", take, stream_decode)
 
 
     def alerts_longpoll(self, job_id, normalized_probability_threshold=None,
@@ -679,6 +841,61 @@ class EngineApiClient:
         url = self.base_url + "/jobs/" + job_id
         return self._delete(url, 'Delete job')
 
+    def deleteJobs(self, job_ids, workers=8, retries=2, rate_limit=None,
+            progress_callback=None):
+        """
+        Delete many jobs using up to workers concurrent requests.
+        A deletion that fails with a connection error or a 5xx status
+        is retried up to retries times, waiting a little longer before
+        each attempt.
+        rate_limit if set is the maximum number of delete requests
+          started per second across all the workers
+        progress_callback if set is called with the arguments
+          (job_id, http_status_code, response) as each job's deletion
+          completes. It is called from a worker thread.
+
+        Returns a dictionary of job_id to the final
+        (http_status_code, response_data) tuple for every job. If a
+        job's last attempt failed with a connection error its tuple
+        is (None, {'error' : message}).
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return dict()
+
+        limiter = _RateLimiter(rate_limit) if rate_limit else None
+
+        def deleteJob(job_id):
+            attempt = 0
+            while True:
+                if limiter:
+                    limiter.wait()
+                try:
+                    (http_status_code, response) = self.delete(job_id)
+                    if http_status_code < 500 or attempt >= retries:
+                        break
+                except (httplib.HTTPException, socket.error) as error:
+                    logging.warn("Delete job " + job_id + " failed: " + repr(error))
+                    if attempt >= retries:
+                        (http_status_code, response) = (None, {'error' : repr(error)})
+                        break
+
+                attempt += 1
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+            if progress_callback:
+                progress_callback(job_id, http_status_code, response)
+            return (http_status_code, response)
+
+        pool = ThreadPool(min(workers, len(job_ids)))
+        try:
+            results = pool.map(deleteJob, job_ids)
+        finally:
+            pool.close()
+            pool.join()
+
+        return dict(zip(job_ids, results))
+
     def getZippedLogs(self, job_id):
         """
         Download the zipped log files of a job and
@@ -746,6 +963,16 @@ class EngineApiClient:
         :return: (http_status_code, model_snapshots) tuple if successful,
             if not (i.e. http_status_code != 200) (http_status_code, error_doc) is returned
         """
+
+        url = self._modelSnapshotsUrl(job_id, skip, take, start_date, end_date, sort_field,
+            sort_descending, description)
+        return self._get(url, "Model Snapshots")
+
+    def _modelSnapshotsUrl(self, job_id, skip, take, start_date, end_date, sort_field,
+            sort_descending, description):
+        """
+        Return the URL of a page of the job's model snapshots
+        """
         start_arg = ''
         if start_date:
             start_arg = '&start=' + urllib.quote(start_date)
@@ -762,10 +989,27 @@ class EngineApiClient:
         if description:
             description_arg = '&description=' + urllib.quote(description)
 
-        url = self.base_url + "/modelsnapshots/{0}?skip={1}&take={2}{3}{4}{5}{6}".format(
+        return self.base_url + "/modelsnapshots/{0}?skip={1}&take={2}{3}{4}{5}{6}".format(
             job_id, skip, take, start_arg, end_arg, sort_arg, description_arg)
 
-        return self._get(url, "Model Snapshots")
+    def iterModelSnapshots(self, job_id, start_date=None, end_date=None,
+                           sort_field=None, sort_descending=True,
+                           description=None, take=100, stream_decode=False):
+        """
+        Generator yielding the job's model snapshots one at a time.
+
+        :param job_id: the job id
+        :param take: the number of snapshots requested in each page
+        :param stream_decode: if True decode each snapshot as it is read
+            from the socket rather than a page at a time
+        The other parameters are the same as getModelSnapshots
+        :raises EngineApiError: if a request fails
+        """
+        def pageUrl(skip, take):
+            return self._modelSnapshotsUrl(job_id, skip, take, start_date, end_date,
+                sort_field, sort_descending, description)
+
+        return self._iterPages(pageUrl, "Model Snapshots", take, stream_decode)
 
 
     def revertToSnapshot(self, job_id, time=None, snapshot_id=None, description=None, delete_intervening_results=False):
@@ -895,6 +1139,126 @@ class EngineApiClient:
         url = self.base_url + "/validate/transforms"
         return self._post(url, 'Validate transforms', headers, payload)
 
+    def _getAllPages(self, url, request_description, take, prefetch):
+        """
+          Read every page of a paged results endpoint and return the
+          documents from all the pages in order.
+
+          url must contain '{0}' and '{1}' placeholders for the skip and
+          take arguments. The first page is read to find the hitCount
+          then the remaining pages are requested in parallel by up to
+          prefetch threads. If more documents were added while the pages
+          were being read they are fetched one page at a time after.
+
+          Returns a (200, documents) tuple if successful else the
+          (http_status_code, error_doc) of the first failed request.
+        """
+        (http_status_code, result) = self._get(url.format(0, take), request_description)
+        if http_status_code != 200:
+            return (http_status_code, result)
+
+        documents = result['documents']
+        skip = take
+
+        offsets = range(skip, int(result['hitCount']), take)
+        if offsets and prefetch > 1:
+            workers = ThreadPool(min(prefetch, len(offsets)))
+            try:
+                pages = workers.map(
+                    lambda offset: self._get(url.format(offset, take), request_description),
+                    offsets)
+            finally:
+                workers.close()
+                workers.join()
+
+            for (http_status_code, result) in pages:
+                if http_status_code != 200:
+                    return (http_status_code, result)
+                documents.extend(result['documents'])
+
+            skip = offsets[-1] + take
+
+        # is there another page of results
+        while result['nextPage']:
+            (http_status_code, result) = self._get(url.format(skip, take), request_description)
+            if http_status_code != 200:
+                return (http_status_code, result)
+
+            documents.extend(result['documents'])
+            skip += take
+
+        return (200, documents)
+
+    def _iterPages(self, page_url, request_description, take, stream_decode):
+        """
+          Generator over the documents of a paged results endpoint.
+          page_url is a function of (skip, take) returning the URL
+          of that page.
+          If stream_decode is True the documents are decoded from the
+          response one at a time, else each page is read and decoded
+          in full before its documents are yielded.
+
+          Raises EngineApiError if a page cannot be read
+        """
+        skip = 0
+        while True:
+            url = page_url(skip, take)
+            if stream_decode:
+                result = dict()
+                for document in self._streamDocuments(url, request_description, result):
+                    yield document
+            else:
+                (http_status_code, result) = self._get(url, request_description)
+                if http_status_code != 200:
+                    raise EngineApiError(http_status_code, result)
+
+                for document in result['documents']:
+                    yield document
+
+            if not result.get('nextPage'):
+                return
+
+            skip += take
+
+    def _streamDocuments(self, url, request_description, page_fields):
+        """
+          Generator that GETs a page of results and yields each element of
+          the page's documents array as soon as it has been decoded.
+          The other fields of the page (hitCount, nextPage, etc) are added
+          to the page_fields dictionary.
+
+          The connection is held until the page has been consumed, if the
+          generator is abandoned part way through the connection is closed
+          rather than returned to the pool.
+
+          Raises EngineApiError if the response status is not 200
+        """
+        connection = self.pool.acquire()
+        try:
+            connection.request("GET", url)
+            response = connection.getresponse()
+
+            if response.status == 200:
+                logging.debug("Get " + request_description + " response = " + str(response.status))
+
+                stream = DocumentStream(response)
+                for document in stream:
+                    yield document
+                page_fields.update(stream.fields)
+
+            # read all of the response before another request can be made
+            data = response.read()
+        except:
+            self.pool.release(connection, False)
+            raise
+
+        self.pool.release(connection, not response.will_close)
+
+        if response.status != 200:
+            logging.error("Get " + request_description + " response = " + str(response.status) + " "
+                + response.reason)
+            raise EngineApiError(response.status, json.loads(data) if data else dict())
+
     def _get(self, url, request_description, expects_json=True):
         """
           General GET request.
@@ -907,9 +1271,7 @@ class EngineApiClient:
           Returns a (status code, JSON/dictonary object) tuple if expects_json
           is true else (status code, response).
         """
-        self.connection.connect()
-        self.connection.request("GET", url)
-        response = self.connection.getresponse();
+        (response, data) = self._request("GET", url)
 
         if response.status != 200:
             logging.error("Get " + request_description + " response = " + str(response.status) + " "
@@ -917,7 +1279,6 @@ class EngineApiClient:
         else:
             logging.debug("Get " + request_description + " response = " + str(response.status))
 
-        data = response.read()
         if not expects_json:
             return (response.status, data)
 
@@ -926,8 +1287,6 @@ class EngineApiClient:
         else:
             job = dict()
 
-        self.connection.close()
-
         return (response.status, job)
 
 
@@ -983,10 +1342,7 @@ class EngineApiClient:
           Returns a (status code, JSON/dictonary object) tuple
         """
 
-        self.connection.connect()
-        self.connection.request(method, url, payload, headers)
-
-        response = self.connection.getresponse()
+        (response, data) = self._request(method, url, payload, headers)
 
         if not response.status in [200, 201, 202]:
             logging.error(request_description + " response = " + str(response.status) + " "
@@ -994,14 +1350,11 @@ class EngineApiClient:
         else:
             logging.debug(request_description + " response = " + str(response.status))
 
-        data = response.read()
         if data:
             doc = json.loads(data)
         else:
             doc = dict()
 
-        self.connection.close()
-
         return (response.status, doc)
 
     def _uploadToEndpoint(self, job_id, data, endpoint, gzipped=False):
@@ -1021,21 +1374,85 @@ class EngineApiClient:
 
         url = self.base_url + "/" + endpoint + "/" + job_id
 
-        self.connection.connect()
-        self.connection.request("POST", url, data, headers)
-        response = self.connection.getresponse();
+        compression_level = self._compressionLevel(gzipped)
+        if compression_level and hasattr(data, 'read'):
+            # the compressed length is not known in advance so
+            # the file is compressed into a chunked upload
+            uploader = ChunkedUploader(self.pool, url, compression_level=compression_level)
+            uploader.open()
+            try:
+                block = data.read(UPLOAD_BLOCK_SIZE)
+                while block:
+                    uploader.write(block)
+                    block = data.read(UPLOAD_BLOCK_SIZE)
+
+                return uploader.close(expects_json=False)
+            except:
+                uploader.abort()
+                raise
+
+        if compression_level:
+            compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+
+        (response, data) = self._request("POST", url, data, headers)
         if response.status != 202:
             logging.error(endpoint + " response = " + str(response.status)
                 + " " + response.reason)
         else:
             logging.debug(endpoint + " response = " + str(response.status))
 
-        # read all of the response before another request can be made
-        data = response.read()
+        return (response.status, data)
 
-        self.connection.close()
+    def _uploadPart(self, url, endpoint, body, length, headers):
+        """
+        POST the list of strings or buffers in body as a single request
+        of length bytes. Returns a (http_status_code, response) tuple.
+        """
+        part_headers = dict(headers)
+        part_headers['Content-Length'] = str(length)
 
-        return (response.status, data)
+        (response, data) = self._request("POST", url, body, part_headers)
+        if response.status != 202:
+            logging.error(endpoint + " response = " + str(response.status)
+                + " " + response.reason)
+        else:
+            logging.debug(endpoint + " response = " + str(response.status))
+
+        if data:
+            doc = json.loads(data)
+        else:
+            doc = dict()
+
+        return (response.status, doc)
+
+    def _recordParts(self, mapped, size, part_size):
+        """
+        Generate (start, end) offsets splitting the mapped file into
+        parts of at least part_size bytes ending with a newline, the
+        last part ends at the end of the file. If part_size is not set
+        the whole file is one part.
+        """
+        start = 0
+        while start < size:
+            end = size
+            if part_size and start + part_size < size:
+                newline = mapped.find('\n', start + part_size - 1)
+                if newline >= 0:
+                    end = newline + 1
+
+            yield (start, end)
+            start = end
+
+    def _compressionLevel(self, gzipped):
+        """
+            The compression level to apply to data being sent,
+            None if the data is already gzipped
+        """
+        if gzipped:
+            return None
+        return self.compression_level or None
 
     def _delete(self, url, request_description):
         """
@@ -1043,20 +1460,76 @@ class EngineApiClient:
             Returns a (http_status_code, response_data) tuple, if
             http_status_code != 200 response_data is an error object.
         """
-        self.connection.connect()
-        self.connection.request("DELETE", url)
-
-        response = self.connection.getresponse()
+        (response, data) = self._request("DELETE", url)
         if response.status != 200:
             logging.error(request_description + " response = " + str(response.status)
                 + " " + response.reason)
 
-        data = response.read()
         if data:
             msg = json.loads(data)
         else:
             msg = dict()
 
-        self.connection.close()
-
-        return (response.status, msg)
\ No newline at end of file
+        return (response.status, msg)
+
+    def _request(self, method, url, body=None, headers={}):
+        """
+            Send the request on a pooled keep-alive connection and read
+            the whole response so the connection can be reused.
+
+            A connection taken from the pool may have been closed by the
+            server since it was last used. If so the request is retried
+            on another connection, up to STALE_CONNECTION_RETRIES times.
+            Once the request has been written only idempotent requests
+            are retried, the server may have processed a POST before the
+            connection failed and sending it again would repeat it. Those
+            rely on the pool discarding connections the server has closed.
+            A body that is a file object is never retried as it cannot be
+            read a second time.
+
+            body may also be a list of strings or buffers which are
+            sent one after the other, the caller must then set the
+            Content-Length header.
+
+            Returns a (response, response_data) tuple
+        """
+        # job ids decoded from JSON are unicode, a unicode url would
+        # make httplib try to decode a binary (e.g. gzipped) body
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        retries = 0
+        while True:
+            connection = self.pool.acquire()
+            reused = connection.sock is not None
+            sent = False
+            try:
+                if isinstance(body, list):
+                    connection.request(method, url, None, headers)
+                    for piece in body:
+                        connection.send(piece)
+                else:
+                    connection.request(method, url, body, headers)
+                sent = True
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                self.pool.release(connection, False)
+
+                retryable = reused and retries < STALE_CONNECTION_RETRIES and \
+                    not hasattr(body, 'read') and \
+                    (not sent or method in IDEMPOTENT_METHODS)
+                if not retryable:
+                    raise
+
+                retries += 1
+
+                logging.debug("Pooled connection failed, retrying " + method + " " + url)
+            except:
+                self.pool.release(connection, False)
+                raise
+
+        self.pool.release(connection, not response.will_close)
+
+        return (response, data)
\ No newline at end of file
@@ -1 +1,2 @@
-from .EngineApiClient import EngineApiClient
\ No newline at end of file
+from .EngineApiClient import EngineApiClient, EngineApiError
+from .AsyncEngineApiClient import AsyncEngineApiClient
\ No newline at end of file
@@ -35,7 +35,7 @@ import json
 import logging
 import time
 
-from prelert.engineApiClient import EngineApiClient
+from prelert.engineApiClient import EngineApiClient, EngineApiError
 
 # defaults
 HOST = 'localhost'
@@ -73,10 +73,17 @@ def printHeader():
     print "Date,Anomaly Score,Max Normalized Probablility"
 
 def printBuckets(buckets):
+    '''
+        Print the buckets as they are read and return
+        the last one or None if there were no buckets
+    '''
+    bucket = None
     for bucket in buckets:
         print "{0},{1},{2}".format(bucket['timestamp'], bucket['anomalyScore'], 
             bucket['maxNormalizedProbability'])
 
+    return bucket
+
 def main():
 
     setupLogging()
@@ -89,24 +96,20 @@ def main():
 
     # Get all the buckets up to now
     logging.info("Get result buckets for job " + job_id)
-    (http_status_code, response) = engine_client.getAllBuckets(job_id, 
-        include_records=False, 
-        anomaly_score_filter_value=args.anomalyScore,
-        normalized_probability_filter_value=args.normalizedProbability)
-
-    
-    if http_status_code != 200:
-        print (http_status_code, json.dumps(response))
+    try:
+        printHeader()
+        last_bucket = printBuckets(engine_client.iterBuckets(job_id, 
+            include_records=False, 
+            anomaly_score_filter_value=args.anomalyScore,
+            normalized_probability_filter_value=args.normalizedProbability))
+    except EngineApiError as error:
+        print (error.http_status_code, json.dumps(error.error_doc))
         return
-    
-    
-    printHeader()
-    printBuckets(response)
 
     if args.continue_poll:
 
-        if len(response) > 0:
-            next_bucket_id = int(response[-1]['id']) + 1
+        if last_bucket != None:
+            next_bucket_id = int(last_bucket['id']) + 1
         else:
             next_bucket_id = None
         
@@ -114,20 +117,18 @@ def main():
             # Wait POLL_INTERVAL_SECS then query for any new buckets
             time.sleep(POLL_INTERVAL_SECS)
 
-            (http_status_code, response) = engine_client.getBucketsByDate(job_id=job_id, 
-                start_date=str(next_bucket_id), end_date=None, 
-                include_records=False,         
-                anomaly_score_filter_value=args.anomalyScore,
-                normalized_probability_filter_value=args.normalizedProbability)
-
-            if http_status_code != 200:
-                print (http_status_code, json.dumps(response))
+            try:
+                last_bucket = printBuckets(engine_client.iterBuckets(job_id=job_id, 
+                    start_date=str(next_bucket_id) if next_bucket_id != None else None,
+                    include_records=False,         
+                    anomaly_score_filter_value=args.anomalyScore,
+                    normalized_probability_filter_value=args.normalizedProbability))
+            except EngineApiError as error:
+                print (error.http_status_code, json.dumps(error.error_doc))
                 break
-
-            printBuckets(response)
             
-            if len(response) > 0:
-                next_bucket_id = int(response[-1]['id']) + 1
+            if last_bucket != None:
+                next_bucket_id = int(last_bucket['id']) + 1
 
 
 if __name__ == "__main__":
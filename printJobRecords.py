@@ -33,7 +33,7 @@ import json
 import logging
 import time
 
-from prelert.engineApiClient import EngineApiClient
+from prelert.engineApiClient import EngineApiClient, EngineApiError
 
 # defaults
 HOST = 'localhost'
@@ -84,32 +84,13 @@ def main():
     # Get all the records up to now
     logging.info("Get records for job " + job_id)
 
-    skip = 0
-    take = 200
-    (http_status_code, response) = engine_client.getRecords(job_id, skip, take,
+    try:
+        printHeader()
+        printRecords(engine_client.iterRecords(job_id, take=200,
                             normalized_probability_filter_value=args.normalizedProbability, 
-                            anomaly_score_filter_value=args.anomalyScore)        
-    if http_status_code != 200:
-        print (http_status_code, json.dumps(response))
-        return
-
-    hit_count = int(response['hitCount'])
-
-    printHeader()
-    printRecords(response['documents'])
-
-    while (skip + take) < hit_count:
-        skip += take
-
-        (http_status_code, response) = engine_client.getRecords(job_id, skip, take,
-                            normalized_probability_filter_value=args.normalizedProbability, 
-                            anomaly_score_filter_value=args.anomalyScore)        
-
-        if http_status_code != 200:
-            print (http_status_code, json.dumps(response))
-            return
-
-        printRecords(response['documents'])
+                            anomaly_score_filter_value=args.anomalyScore))
+    except EngineApiError as error:
+        print (error.http_status_code, json.dumps(error.error_doc))
 
 
 if __name__ == "__main__":
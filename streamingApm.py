@@ -21,8 +21,11 @@ This script creates a new job and uploads to it APM data records
 generated from existing data in a CSV file. New records will created
 indefinitely or until the 'duration' argument expires. Each record has
 a new timestamp so this script can be used to repeatedly replay the
-historical data. After each upload of data the script requests any new
-bucket results and prints them.
+historical data. The records are sent in one long running upload
+stream while a background thread polls the job for new bucket results
+every '--poll-interval' seconds and prints them, so uploading never
+waits on the results. When the script stops it reports the upload
+throughput making it a simple end to end benchmark of the Engine.
 
 The script is invoked with 1 positional argument -the CSV file containing
 APM to use a the source of the generated data- and optional arguments
@@ -34,13 +37,23 @@ http://s3.amazonaws.com/prelert_demo/network.csv
 
 If no 'duration' is set the script will run indefinitely cse Ctrl-C to
 stop the script - the interrupt is caught and the job closed gracefully
+
+The CSV file is read once and each row stored already encoded either
+side of its time field so generating a record only costs formatting
+its timestamp. Set '--rate' to replay a steady number of records per
+second when using the script to load test the Engine.
 '''
 
 import argparse
+import calendar
 import csv
+import httplib
 import json
 import logging
+import socket
+import StringIO
 import sys
+import threading
 import time
 from datetime import datetime, timedelta, tzinfo
 
@@ -53,6 +66,13 @@ BASE_URL = 'engine/v2'
 
 ZERO_OFFSET = timedelta(0)
 
+# The number of records generated and written
+# to the upload stream at a time
+CHUNK_RECORDS = 1000
+
+# Seconds between requests for new bucket results
+POLL_INTERVAL = 10
+
 class UtcOffset(tzinfo):
     '''
     Timezone object at 0 (UTC) offset
@@ -77,81 +97,193 @@ def parseArguments():
     parser.add_argument("--duration", help="The number of hours to generate \
         data for. If not set script will produce records from the historical \
         start date until the time now", type=int, default=0)
+    parser.add_argument("--rate", help="Generate this many records per \
+        second. If not set records are generated as fast as they can be \
+        uploaded", type=float, default=None)
+    parser.add_argument("--batch-size", help="The number of records generated \
+        and written to the upload stream at a time, defaults to "
+        + str(CHUNK_RECORDS), type=int, default=CHUNK_RECORDS, dest="batch_size")
+    parser.add_argument("--poll-interval", help="Seconds between requests for \
+        new bucket results, defaults to " + str(POLL_INTERVAL), type=float,
+        default=POLL_INTERVAL, dest="poll_interval")
     parser.add_argument("file", help="Path to APM data")
 
     return parser.parse_args()
 
 
-def generateRecords(csv_filename, start_date, interval, end_date):
+def encodeCsv(fields):
     '''
-    Generator function reads csv data file and returns records
-    with an updated timestamp on demand.
+    Return the list of fields as a line of csv without the line end
+    '''
+    buf = StringIO.StringIO()
+    csv.writer(buf, lineterminator='\n').writerow(fields)
+    return buf.getvalue()[:-1]
 
-    Records are read from a file and stored in a local array, once
-    all the records have been read the function does not loop
-    round to the beginning again instead it flips and outputs
-    the records in reverse order and so on.
 
-    The csv file must contain a field with the name 'time'
+class ApmReplay:
     '''
+    Replays the records of an APM csv file with new timestamps.
 
-    csv_data = []
-    csv_file = open(csv_filename, 'rb')
-    reader = csv.reader(csv_file)
-    header = reader.next()
+    The records are read once and stored as two columns of csv encoded
+    text, the fields before the time field and those after it, so a
+    record is generated by joining its text with the new timestamp.
+    Once all the records have been output they are not looped round to
+    the beginning again instead they flip and are output in reverse
+    order and so on.
 
-    time_field_idx = -1
-    for i in range(len(header)):
-        if header[i] == 'time':
-            time_field_idx = i
-            break
-
-    if time_field_idx == -1:
-        logging.error("Cannot find 'time' field in csv header")
-        return
+    The csv file must contain a field with the name 'time'
+    '''
 
-    reverse = False
-    while start_date < end_date:
-        try:
-            yield header
+    def __init__(self, csv_filename):
+        '''
+        Read the csv file, raises ValueError if there
+        is no 'time' field in the header
+        '''
+        with open(csv_filename, 'rb') as csv_file:
+            reader = csv.reader(csv_file)
+            header = reader.next()
+
+            if 'time' not in header:
+                raise ValueError("Cannot find 'time' field in csv header")
+            time_field_idx = header.index('time')
+
+            self.header = encodeCsv(header) + '\n'
+
+            self.prefixes = []
+            self.suffixes = []
+            for row in reader:
+                before = row[:time_field_idx]
+                after = row[time_field_idx + 1:]
+                self.prefixes.append(encodeCsv(before) + ',' if before else '')
+                self.suffixes.append(',' + encodeCsv(after) + '\n' if after else '\n')
+
+        # the reverse pass follows the forward pass
+        self.prefixes += reversed(self.prefixes)
+        self.suffixes += reversed(self.suffixes)
+
+        # time of day strings by second of the day
+        self._times = dict()
+
+    def timestamps(self, start, step, count):
+        '''
+        Return a list of count ISO 8601 timestamps starting at start
+        epoch seconds step seconds apart. Only the date is formatted
+        for each day, the time of day strings are cached.
+        '''
+        stamps = []
+        day = None
+        for timestamp in xrange(start, start + step * count, step):
+            (days, seconds) = divmod(timestamp, 86400)
+            if days != day:
+                day = days
+                date = time.strftime('%Y-%m-%dT', time.gmtime(timestamp))
+
+            time_of_day = self._times.get(seconds)
+            if time_of_day == None:
+                time_of_day = self._times[seconds] = '{0:02d}:{1:02d}:{2:02d}+00:00'.format(
+                    seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+            stamps.append(date + time_of_day)
+
+        return stamps
+
+    def chunks(self, start_date, interval, end_date, chunk_records=CHUNK_RECORDS, rate=None):
+        '''
+        Generator yielding the records timestamped from start_date to
+        end_date interval apart as strings of up to chunk_records csv
+        lines, without the header. If rate is set the chunks are
+        yielded at that many records per second.
+        '''
+        cycle = len(self.prefixes)
+        if cycle == 0:
+            return
+
+        start = calendar.timegm(start_date.utctimetuple())
+        end = calendar.timegm(end_date.utctimetuple())
+        step = int(interval.total_seconds())
+        remaining = (end - start + step - 1) // step
+
+        started = time.time()
+        generated = 0
+        while remaining > 0:
+            count = min(chunk_records, remaining)
+            stamps = self.timestamps(start + generated * step, step, count)
+
+            lines = []
+            i = generated % cycle
+            for stamp in stamps:
+                lines.append(self.prefixes[i] + stamp + self.suffixes[i])
+                i += 1
+                if i == cycle:
+                    i = 0
+
+            generated += count
+            remaining -= count
+
+            if rate:
+                # hold the chunk back until the rate allows it
+                wait = started + generated / rate - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+
+            yield ''.join(lines)
+
+
+
+class BucketPoller:
+    '''
+    Requests the job's new buckets every interval seconds in a
+    background thread and prints them
+    '''
 
-            if len(csv_data) == 0:
-                # populate csv_data record
-                for row in reader:
-                    row[time_field_idx] = start_date.isoformat()
-                    start_date += interval
+    def __init__(self, engine_client, job_id, interval=POLL_INTERVAL):
+        self.engine_client = engine_client
+        self.job_id = job_id
+        self.interval = interval
 
-                    csv_data.append(row)
-                    yield row
+        self.next_bucket_id = 1
+        self.buckets = 0
 
-                    if start_date > end_date:
-                        break
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
 
-                csv_file.close()
+    def start(self):
+        self._thread.start()
 
-            else:
-                if reverse:
-                    for row in reversed(csv_data):
-                        row[time_field_idx] = start_date.isoformat()
-                        start_date += interval
-                        yield row
+    def stop(self):
+        '''
+        Stop the polling thread then print any remaining buckets
+        '''
+        self._stopped.set()
+        self._thread.join()
+        self.poll()
 
-                        if start_date > end_date:
-                            break
-                else:
-                    for row in csv_data:
-                        row[time_field_idx] = start_date.isoformat()
-                        start_date += interval
-                        yield row
+    def poll(self):
+        '''
+        Get the buckets after the last one printed and print them.
+        Returns False if the request failed.
+        '''
+        (http_status_code, response) = self.engine_client.getBucketsByDate(job_id=self.job_id,
+            start_date=str(self.next_bucket_id), end_date=None)
+        if http_status_code != 200:
+            print (http_status_code, json.dumps(response))
+            return False
 
-                        if start_date > end_date:
-                            break
+        for bucket in response:
+            print "{0},{1},{2}".format(bucket['timestamp'],
+                bucket['anomalyScore'], bucket['maxNormalizedProbability'])
 
-            reverse = not reverse
+        if len(response) > 0:
+            self.next_bucket_id = int(response[-1]['id']) + 1
+            self.buckets += len(response)
 
-        except KeyboardInterrupt:
-            raise StopIteration
+        return True
 
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.poll():
+                return
 
 
 def main():
@@ -188,6 +320,13 @@ def main():
     }'
 
 
+    # read the APM data
+    try:
+        replay = ApmReplay(args.file)
+    except (IOError, ValueError) as error:
+        logging.error(str(error))
+        return
+
     engine_client = EngineApiClient(args.host, BASE_URL, args.port)
     (http_status_code, response) = engine_client.createJob(job_config)
     if http_status_code != 201:
@@ -197,56 +336,55 @@ def main():
     job_id = response['id']
     print 'Job created with Id = ' + job_id
 
-    # get the csv header (the first record generated)
-    record_generator = generateRecords(args.file, start_date, interval, end_date)
-    header = ','.join(next(record_generator))
-    header += '\n'
+    print
+    print "Date,Anomaly Score,Max Normalized Probablility"
 
-    count = 0
+    # the results are requested concurrently with the upload
+    poller = BucketPoller(engine_client, job_id, args.poll_interval)
+    poller.start()
+
+    # all the records are sent in one upload so the header is sent once
+    uploader = engine_client.openStream(job_id)
+    uploader.write(replay.header)
+
+    records = 0
+    start_time = time.time()
     try:
-        # for the results
-        next_bucket_id = 1
-        print
-        print "Date,Anomaly Score,Max Normalized Probablility"
-
-        data = header
-        for record in record_generator:
-            # format as csv and append new line
-            csv = ','.join(record) + '\n'
-            data += csv
-            # print data
-
-            count += 1
-            if count == 100:
-                (http_status_code, response) = engine_client.upload(job_id, data)
-                if http_status_code != 202:
-                    print (http_status_code, json.dumps(response))
-                    break
-
-                # get the latest results...
-                (http_status_code, response) = engine_client.getBucketsByDate(job_id=job_id,
-                    start_date=str(next_bucket_id), end_date=None)
-                if http_status_code != 200:
-                    print (http_status_code, json.dumps(response))
-                    break
-
-                # and print them
-                for bucket in response:
-                    print "{0},{1},{2},{3}".format(bucket['timestamp'],
-                        bucket['anomalyScore'], bucket['maxNormalizedProbability'])
-
-                if len(response) > 0:
-                    next_bucket_id = int(response[-1]['id']) + 1
-
-                # must send the header every time
-                data = header
-                count = 0
-
-            # sleep a little while (optional this can be removed)
-            #time.sleep(0.1)
+        for chunk in replay.chunks(start_date, interval, end_date,
+                args.batch_size, args.rate):
+            uploader.write(chunk)
+            records += chunk.count('\n')
+            if args.rate:
+                # the next chunk is held back, send this one now
+                uploader.flush()
 
     except KeyboardInterrupt:
         print "Keyboard interrupt closing job..."
+    except (socket.error, httplib.HTTPException) as error:
+        print "Upload failed: " + str(error)
+
+    if uploader.broken:
+        # a chunk was cut off part way, the upload cannot be ended
+        # cleanly so drop its connection, the job is still closed
+        uploader.abort()
+    else:
+        try:
+            (http_status_code, response) = uploader.close()
+            if http_status_code != 202:
+                print (http_status_code, json.dumps(response))
+        except (socket.error, httplib.HTTPException) as error:
+            print "Upload failed: " + str(error)
+    elapsed = time.time() - start_time
+
+    poller.stop()
+
+    stats = uploader.stats()
+    print
+    print "Uploaded {0} records in {1:.1f} seconds, {2:.0f} records/s".format(
+        records, elapsed, records / elapsed if elapsed > 0 else 0.0)
+    print "{0} bytes sent in {1} chunks, {2:.1f} seconds waiting on the Engine".format(
+        stats['bytes_sent'], stats['chunks_sent'], stats['send_wait'])
+    print "{0} buckets of results".format(poller.buckets)
 
     (http_status_code, response) = engine_client.close(job_id)
     if http_status_code != 202:
@@ -0,0 +1,178 @@
+############################################################################
+#                                                                          #
+# Copyright 2016 Prelert Ltd                                               #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+"""
+Stress test sharing one EngineApiClient between many threads.
+
+A threaded HTTP server echoes the path and body of every request so
+each thread can check it got the response to its own request while
+GETs, uploads and streamed uploads run at once over the pooled
+connections.
+
+    python -m unittest discover tests
+"""
+
+import BaseHTTPServer
+import json
+import random
+import SocketServer
+import threading
+import time
+import unittest
+
+from prelert.engineApiClient import EngineApiClient
+
+BASE_URL = 'engine/v2'
+
+THREADS = 8
+CALLS_PER_THREAD = 40
+
+
+class EchoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers every request with the path and the body it received,
+    after a short random delay so the requests interleave
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._echo(200, '')
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self._readChunked()
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._echo(202, body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _readChunked(self):
+        parts = []
+        while True:
+            size = int(self.rfile.readline().split(';')[0], 16)
+            if size == 0:
+                break
+            parts.append(self.rfile.read(size))
+            self.rfile.readline()
+
+        # skip any trailers up to the blank line
+        while self.rfile.readline().strip():
+            pass
+        return ''.join(parts)
+
+    def _echo(self, status, body):
+        time.sleep(random.random() * 0.005)
+        doc = json.dumps({'path' : self.path, 'body' : body})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(doc)))
+        self.end_headers()
+        self.wfile.write(doc)
+
+
+class EchoServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadSafetyTest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.server = EchoServer(('localhost', 0), EchoHandler)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testSharedClient(self):
+        client = EngineApiClient('localhost', BASE_URL, self.port)
+        self._stress(client)
+
+    def testSharedClientLimitedConnections(self):
+        # fewer connections than threads so acquire() has to wait
+        client = EngineApiClient('localhost', BASE_URL, self.port,
+            pool_size=2, max_connections=3)
+        self._stress(client)
+
+
+    def _stress(self, client):
+        """
+        Run the mixed calls from THREADS threads at once, fail if any
+        response did not belong to its request or a connection was
+        not returned to the pool
+        """
+        errors = []
+        start = threading.Event()
+
+        def worker(thread_index):
+            start.wait()
+            try:
+                for call in range(CALLS_PER_THREAD):
+                    self._call(client, '{0}-{1}'.format(thread_index, call))
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join(60)
+
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(errors, [])
+        self.assertEqual(client.pool._checked_out, 0)
+
+    def _call(self, client, token):
+        """
+        Make a randomly chosen call tagged with token and
+        check the response echoes the same token
+        """
+        kind = random.choice(('get', 'upload', 'stream'))
+
+        if kind == 'get':
+            (status, doc) = client.getJob(token)
+            self.assertEqual(status, 200)
+            self.assertEqual(doc['path'], '/' + BASE_URL + '/jobs/' + token)
+
+        elif kind == 'upload':
+            data = ''.join('{{"token":"{0}","n":{1}}}\n'.format(token, n) for n in range(20))
+            (status, doc) = client.upload(token, data)
+            self.assertEqual(status, 202)
+            self.assertEqual(doc['path'], '/' + BASE_URL + '/data/' + token)
+            self.assertEqual(doc['body'], data)
+
+        else:
+            records = ['{{"token":"{0}","n":{1}}}\n'.format(token, n) for n in range(50)]
+            uploader = client.openStream(token, chunk_size=256)
+            for record in records:
+                uploader.write(record)
+            (status, doc) = uploader.close()
+            self.assertEqual(status, 202)
+            self.assertEqual(doc['path'], '/' + BASE_URL + '/data/' + token)
+            self.assertEqual(doc['body'], ''.join(records))
+
+
+if __name__ == '__main__':
+    unittest.main()